@@ -0,0 +1,207 @@
+import os
+import glob
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+from cancer_wl_engine import (GROUPING_COLS, forecast_waitlist, situation_weekly,
+                              week_ordinals, open_week_store, DEFAULT_SITES,
+                              future_slots_index, situation_slots, ESTIMATORS,
+                              ESTIMATOR_WINDOW)
+
+################################################################################
+                            #####Slot Snapshots#####
+################################################################################
+#Every run's combine checkpoint keeps the future slots as they were pulled that
+#day, so the checkpoints are a store of slot snapshots to replay the model
+#from. The slots can't be pulled again later, as booked sessions change.
+def load_snapshots(checkpoint_root, sites=DEFAULT_SITES):
+    #Function to read the future slots of every run with a combine checkpoint.
+    #Batch mode runs save one combine checkpoint with the slots of all their
+    #sites, so only the slots of sites are kept (slots with no Site column are
+    #kept as they are). Returns {run date: (cancer_slots, fut_weeks)}, oldest
+    #first.
+    snapshots = {}
+    for path in sorted(glob.glob(os.path.join(checkpoint_root, '*',
+                                              'combine.pkl'))):
+        with open(path, 'rb') as f:
+            outputs = pickle.load(f)
+        cancer_slots = outputs['cancer_slots']
+        if 'Site' in cancer_slots.columns:
+            cancer_slots = (cancer_slots.loc[cancer_slots['Site'].astype(object)
+                                                              .isin(sites)]
+                                        .reset_index(drop=True))
+        run_date = os.path.basename(os.path.dirname(path))
+        snapshots[run_date] = (cancer_slots, outputs['fut_weeks'])
+    return snapshots
+
+def snapshot_slots(snapshots, situations, weeks):
+    #Function to get every situation's slots for the weeks after each
+    #snapshot's origin (the last week before its first forecast week), for
+    #all the snapshots at once. The snapshots are stacked with each
+    #(origin, weeks ahead) as its own 'week', so the slots are looked up in
+    #one pass over the situations. weeks are the week ordinals of the
+    #history, snapshots with an origin outside them are skipped. Returns the
+    #origins' positions in weeks and a (including/excluding undefined,
+    #situation, origin, weeks ahead) array of slots.
+    origins = []
+    frames = []
+    for cancer_slots, fut_weeks in snapshots.values():
+        origin = week_ordinals(fut_weeks[:1])[0] - 1
+        position = origin - weeks[0]
+        if not 0 <= position < len(weeks) or not len(cancer_slots):
+            continue
+        frame = cancer_slots[['Specialty Name', 'Clinic Code', 'New/Follow Up',
+                              'Slots']].astype({'Specialty Name': object,
+                                                'Clinic Code': object,
+                                                'New/Follow Up': object})
+        frame['Origin'] = len(origins)
+        frame['Weeks Ahead'] = week_ordinals(cancer_slots['Week End']) - origin
+        origins.append(position)
+        frames.append(frame)
+    if not frames:
+        raise ValueError('No slot snapshots with an origin in the history')
+    slots = pd.concat(frames, ignore_index=True)
+    n_ahead = slots['Weeks Ahead'].max()
+    slots['Week End'] = slots['Origin'] * n_ahead + slots['Weeks Ahead'] - 1
+    slots_index = future_slots_index(slots, list(range(len(origins) * n_ahead)))
+    keys = zip(*[situations[col] for col in GROUPING_COLS])
+    slots = np.array([situation_slots(slots_index, spec, cc, N_FU,
+                                      len(origins) * n_ahead)
+                      for spec, cc, prior, N_FU in keys])
+    return (np.array(origins),
+            slots.reshape(-1, 2, len(origins), n_ahead).transpose(1, 0, 2, 3))
+
+
+################################################################################
+                              #####Backtest#####
+################################################################################
+#Weeks of history the model starts each forecast from, the same as the
+#sources hold
+HISTORY_WEEKS = 6
+
+def origin_start_points(wl_size, adds, origins, history_weeks=HISTORY_WEEKS,
+                        estimator='mean', window=ESTIMATOR_WINDOW):
+    #Function to get every situation's start point at every origin, as the
+    #model would have from the history_weeks weeks up to it: the last wait list
+    #size and the weekly additions from estimator (a name in ESTIMATORS, 0
+    #where it has no additions in the weeks it uses). Situations with no data
+    #in those weeks wouldn't have been forecast, so their start is nan.
+    #Returns two (situation, origin) arrays.
+    wl_start = (pd.DataFrame(wl_size).ffill(axis=1, limit=history_weeks - 1)
+                                     .values[:, origins])
+    #Each origin's history is a slice of the same array, estimated at once
+    #for every situation
+    est_adds = np.array([ESTIMATORS[estimator](
+                             adds[:, max(origin + 1 - history_weeks, 0):
+                                     origin + 1], window)
+                         for origin in origins]).reshape(len(origins), -1).T
+    return wl_start, np.nan_to_num(est_adds)
+
+def backtest(start, store, snapshots, history_weeks=HISTORY_WEEKS,
+             estimators=('mean',), window=ESTIMATOR_WINDOW):
+    #Function to replay the model from every slot snapshot's origin week for
+    #every situation in start, and compare the forecasts with the wait list
+    #sizes that actually happened in the week store. All situations and
+    #origins are forecast at once, once for each of estimators (names in
+    #ESTIMATORS) so they can be compared. Weeks a situation has no data for
+    #are counted as an empty wait list, weeks after the latest data aren't
+    #compared. Returns a row per estimator, situation, including/excluding
+    #undefined and weeks ahead, with the number of forecasts compared, mean
+    #absolute error and bias (mean of forecast - actual, positive is over
+    #forecasting).
+    weeks = store['weeks']
+    wl_size = situation_weekly(start, store, 'Waitlist Size')
+    adds = situation_weekly(start, store, 'Waitlist Additions')
+    origins, slots = snapshot_slots(snapshots, start, weeks)
+    return pd.concat([estimator_errors(start, wl_size, adds, weeks, origins,
+                                       slots, history_weeks, estimator, window)
+                      for estimator in estimators], ignore_index=True)
+
+def estimator_errors(start, wl_size, adds, weeks, origins, slots,
+                     history_weeks, estimator, window):
+    #Function to forecast every situation from every origin with one
+    #additions estimator and compare with what happened, see backtest.
+    wl_start, est_adds = origin_start_points(wl_size, adds, origins,
+                                             history_weeks, estimator, window)
+    #Rounded, as the forecast is shown on the dashboard
+    fut_WL = np.rint(forecast_waitlist(wl_start, est_adds, slots))
+
+    #What actually happened each week ahead of each origin
+    n_ahead = slots.shape[-1]
+    actual_weeks = origins[:, None] + np.arange(1, n_ahead + 1)
+    actual = np.append(np.nan_to_num(wl_size), np.full((len(start), 1), np.nan),
+                       axis=1)
+    actual = actual[:, np.minimum(actual_weeks, len(weeks))]
+    error = fut_WL - actual
+    compared = ~np.isnan(error)
+    n_forecasts = compared.sum(axis=2)
+    error = np.where(compared, error, 0)
+    mae = np.abs(error).sum(axis=2) / np.maximum(n_forecasts, 1)
+    bias = error.sum(axis=2) / np.maximum(n_forecasts, 1)
+
+    #(including/excluding undefined, situation, weeks ahead) to rows
+    shape = n_forecasts.shape
+    situation = np.broadcast_to(np.arange(len(start))[None, :, None], shape).ravel()
+    results = start[GROUPING_COLS].iloc[situation].reset_index(drop=True)
+    results.insert(0, 'Estimator', estimator)
+    results['Including Undefined'] = np.broadcast_to(np.array(['Y', 'N'])[:, None, None],
+                                                     shape).ravel()
+    results['Weeks Ahead'] = np.broadcast_to(np.arange(1, n_ahead + 1), shape).ravel()
+    results['Forecasts'] = n_forecasts.ravel()
+    results['MAE'] = mae.ravel()
+    results['Bias'] = bias.ravel()
+    return results.loc[results['Forecasts'] > 0].reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest the cancer wait '
+                                     'list forecast against what happened, '
+                                     'from the slot snapshots in the run '
+                                     'checkpoints')
+    parser.add_argument('--work-dir', default='.',
+                        help='folder the model runs in')
+    parser.add_argument('--run-date', help='run to take the actual wait list '
+                        'sizes from, the latest run if not given')
+    parser.add_argument('--history-weeks', type=int, default=HISTORY_WEEKS,
+                        help='weeks of history each forecast starts from '
+                        '(the seasonal estimator needs more than a year)')
+    #Additions estimators to backtest, see ESTIMATORS, each is forecast and
+    #compared separately
+    parser.add_argument('--estimator', nargs='+', choices=list(ESTIMATORS),
+                        default=['mean'])
+    parser.add_argument('--estimator-window', type=int,
+                        default=ESTIMATOR_WINDOW,
+                        help='weeks of additions the rolling, ewma and '
+                        'seasonal estimators average over')
+    parser.add_argument('--site', help='site to backtest, for runs in batch '
+                        'mode (--sites)')
+    args = parser.parse_args()
+
+    checkpoint_root = os.path.join(args.work_dir, 'Checkpoints',
+                                   *([args.site] if args.site else []))
+    run_date = args.run_date or os.path.basename(os.path.dirname(
+                 sorted(glob.glob(os.path.join(checkpoint_root, '*',
+                                               'rollup.pkl')))[-1]))
+    with open(os.path.join(checkpoint_root, run_date, 'rollup.pkl'), 'rb') as f:
+        rollup = pickle.load(f)
+    t = time.time()
+    results = backtest(rollup['start'],
+                       open_week_store(os.path.join(checkpoint_root, run_date,
+                                                    'week_store')),
+                       load_snapshots(checkpoint_root,
+                                      [args.site] if args.site else DEFAULT_SITES),
+                       args.history_weeks, args.estimator, args.estimator_window)
+    print(f'Backtest done in {time.time() - t:.1f}s')
+    #Overall accuracy of the specialty and clinic code forecasts
+    spec_cc = results.loc[(results['Priority'] == 'All')
+                          & (results['New/Follow Up'] == 'All')]
+    print(spec_cc.groupby(['Estimator', 'Including Undefined', 'Weeks Ahead'])
+                 [['Forecasts', 'MAE', 'Bias']]
+                 .agg({'Forecasts': 'sum', 'MAE': 'mean', 'Bias': 'mean'}))
+    file_path = os.path.join(args.work_dir, 'Outputs',
+                             f'Backtest {args.site + " " if args.site else ""}'
+                             f'{run_date}.csv')
+    results.to_csv(file_path, index=False)
+    print(f'Backtest saved to {file_path}')
@@ -0,0 +1,441 @@
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from cancer_wl_excel import write_workbook
+from cancer_wl_extract import (extract_sources, extract_with_cache,
+                               shrink_frame, FULL_HISTORY)
+from cancer_wl_engine import (JOIN_COLS, str_strip, combine_sources, weekly_grouping_sets,
+                              build_week_store, STORE_METRICS,
+                              scenario_start_points, estimate_additions,
+                              SIMULATION_PERCENTILES, dedupe_situations,
+                              forecast_dataset, expand_aliases)
+
+################################################################################
+                            #####Synthetic Data#####
+################################################################################
+#Sizes to benchmark at, roughly small test data up to a few times the real data
+SCALES = {'small': {'n_specialties': 5, 'n_clinic_codes': 20,
+                    'n_priorities': 3, 'n_weeks': 6},
+          'medium': {'n_specialties': 20, 'n_clinic_codes': 200,
+                     'n_priorities': 4, 'n_weeks': 6},
+          'large': {'n_specialties': 40, 'n_clinic_codes': 1000,
+                    'n_priorities': 4, 'n_weeks': 12}}
+
+PRIORITIES = ['Suspected Cancer', 'Routine', 'Urgent', 'Time Critical']
+
+def synthetic_sources(n_specialties=5, n_clinic_codes=20, n_priorities=3,
+                      n_weeks=6, n_fut_weeks=3, seed=0):
+    #Function to make random add, att, wl, pfmgt_spec and cancer_slots frames
+    #with the same columns and types the SQL queries return. Each clinic code
+    #belongs to a specialty (every 5th to two), and each of its groupings only
+    #has data for some weeks, so there is a mix of groupings with more and less
+    #than 6 rows. Some rows have no priority, some are for the excluded 'ZZ'
+    #specialty and some wl specialty codes are padded, as in the real data.
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range(end='2025-06-29', periods=n_weeks, freq='W-SUN')
+    fut_weeks = pd.date_range(weeks[-1] + pd.Timedelta(days=7),
+                              periods=n_fut_weeks, freq='W-SUN')
+    specs = [str(100 + i) for i in range(n_specialties)]
+    clinic_codes = [f'CC{i:04d}' for i in range(n_clinic_codes)]
+    priorities = PRIORITIES[:n_priorities] + [None]
+
+    #Every clinic code/specialty pairing
+    pairs = [(cc, specs[i % n_specialties]) for i, cc in enumerate(clinic_codes)]
+    pairs += [(cc, specs[(i + 1) % n_specialties])
+              for i, cc in enumerate(clinic_codes) if i % 5 == 0]
+    pairs += [(cc, 'ZZ') for cc in clinic_codes[::7]]
+    #Each pairing only has some priorities and appointment types, each of
+    #which only has some weeks of data
+    groups = pd.MultiIndex.from_tuples(
+                [(cc, spec, prior, N_FU) for cc, spec in pairs
+                 for prior in priorities for N_FU in ['New', 'Follow Up']],
+                names=['Clinic Code', 'Specialty Code', 'Priority',
+                       'New/Follow Up']).to_frame(index=False)
+    groups = groups.loc[rng.random(len(groups)) < 0.6]
+    cells = groups.loc[groups.index.repeat(n_weeks)].reset_index(drop=True)
+    cells.insert(0, 'Week End', np.tile(weeks, len(groups)))
+    p_week = np.repeat(rng.uniform(0.2, 1, len(groups)), n_weeks)
+    cells = cells.loc[rng.random(len(cells)) < p_week].reset_index(drop=True)
+
+    rundate = weeks[-1] + pd.Timedelta(days=1)
+    add = cells.sample(frac=0.7, random_state=seed).reset_index(drop=True)
+    add['Waitlist Additions'] = rng.integers(0, 20, len(add))
+    att = cells.sample(frac=0.7, random_state=seed + 1).reset_index(drop=True)
+    att['Attendances'] = rng.integers(0, 20, len(att))
+    att.insert(0, 'rundate', rundate)
+    wl = cells.sample(frac=0.8, random_state=seed + 2).reset_index(drop=True)
+    wl['Waitlist Size'] = rng.integers(0, 200, len(wl))
+    wl['Specialty Code'] = np.where(rng.random(len(wl)) < 0.5,
+                                    wl['Specialty Code'] + ' ',
+                                    wl['Specialty Code'])
+    wl.insert(0, 'rundate', rundate)
+
+    pfmgt_spec = pd.DataFrame({'Specialty Code': specs + ['ZZ'],
+                               'pfmgt_spec': specs + ['ZZ'],
+                               'Specialty': [f'Specialty {spec}' for spec in specs]
+                                            + ['Unknown']})
+
+    slots = pd.DataFrame([(week, f'Specialty {spec}', spec, cc, N_FU)
+                          for cc, spec in pairs if spec != 'ZZ'
+                          for N_FU in ['New', 'Follow Up', 'Undefined']
+                          for week in fut_weeks],
+                         columns=['Week End', 'Specialty Name', 'Specialty',
+                                  'Clinic Code', 'New/Follow Up'])
+    slots = slots.loc[rng.random(len(slots)) < 0.6].reset_index(drop=True)
+    slots['Slots'] = rng.integers(0, 15, len(slots))
+    return add, att, wl, pfmgt_spec, slots
+
+
+################################################################################
+                            #####Golden Output#####
+################################################################################
+def reference_dataset(cancer_wl, cancer_slots, fut_weeks):
+    #The start rollup and situation loop as they were before any optimisation,
+    #kept as the golden output any faster path must match exactly.
+    def aggregation(cols):
+        return (cancer_wl.groupby(cols + ['Week End'], as_index=False)
+                                  [['Waitlist Size', 'Waitlist Additions']].sum()
+                         .groupby(cols, as_index=False)
+                                  .agg({'Waitlist Size':'last',
+                                        'Waitlist Additions':'mean'}))
+
+    start = pd.concat([
+            (pd.DataFrame(cancer_wl.groupby('Week End')
+                          [['Waitlist Size', 'Waitlist Additions']].sum()
+                          .agg({'Waitlist Size': lambda x: x.iloc[-1],
+                                'Waitlist Additions': 'mean'})).T),
+            aggregation(['Specialty']),
+            aggregation(['Clinic Code']),
+            aggregation(['Priority']),
+            aggregation(['New/Follow Up']),
+            aggregation(['Specialty',   'Clinic Code']),
+            aggregation(['Specialty',   'Priority']),
+            aggregation(['Specialty',   'New/Follow Up']),
+            aggregation(['Clinic Code', 'Priority']),
+            aggregation(['Clinic Code', 'New/Follow Up']),
+            aggregation(['Priority',    'New/Follow Up']),
+            aggregation(['Specialty',   'Clinic Code', 'Priority']),
+            aggregation(['Specialty',   'Clinic Code', 'New/Follow Up']),
+            aggregation(['Specialty',   'Priority',    'New/Follow Up']),
+            aggregation(['Clinic Code', 'Priority',    'New/Follow Up']),
+            aggregation(['Specialty', 'Clinic Code', 'Priority', 'New/Follow Up'])
+            ])
+    start[['Waitlist Size',
+           'Waitlist Additions']] = start[['Waitlist Size',
+                                           'Waitlist Additions']].fillna(0)
+    start[['Specialty', 'Clinic Code',
+           'Priority','New/Follow Up']] = start[['Specialty', 'Clinic Code',
+                                                 'Priority', 'New/Follow Up']
+                                                 ].fillna('All')
+
+    output_table = []
+    for cc in start['Clinic Code'].drop_duplicates().values.tolist():
+        if cc != 'All':
+            cc_filter_hist = cancer_wl.loc[cancer_wl['Clinic Code'] == cc].copy()
+            cc_filter_slots = cancer_slots.loc[cancer_slots['Clinic Code'] == cc].copy()
+        else:
+            cc_filter_hist = cancer_wl.copy()
+            cc_filter_slots = cancer_slots.copy()
+        start_filter = start.loc[start['Clinic Code'] == cc].drop('Clinic Code', axis=1)
+
+        for situation in start_filter.values.tolist():
+            WL_start, adds, spec, prior, N_FU = situation
+            main_lookup = spec + cc + prior + N_FU
+            hist_conds = []
+            slots_conds = []
+            if spec != 'All':
+                hist_conds.append(cancer_wl['Specialty'] == spec)
+                slots_conds.append(cancer_slots['Specialty Name'] == spec)
+            if prior != 'All':
+                hist_conds.append(cancer_wl['Priority'] == prior)
+            if N_FU != 'All':
+                hist_conds.append(cancer_wl['New/Follow Up'] == N_FU)
+                slots_conds.append(cancer_slots['New/Follow Up']
+                                   .isin(['Undefined', N_FU]))
+
+            ######################################################Hist Data
+            filter_hist = cc_filter_hist.copy()
+            for cond in hist_conds:
+                filter_hist = filter_hist.loc[cond].copy()
+            if len(filter_hist) > 6:
+                agg_past = (filter_hist.groupby('Week End', as_index=False)
+                            [['Waitlist Size', 'Waitlist Additions', 'Attendances']]
+                            .sum().values.tolist())
+            else:
+                agg_past = filter_hist[['Week End', 'Waitlist Size',
+                           'Waitlist Additions', 'Attendances']].values.tolist()
+            for row in agg_past:
+                week, wl_size, add, att = row
+                output_table.append([week, spec, cc, prior, N_FU, np.nan,
+                                     week+main_lookup, wl_size, add, att, 'Past'])
+
+            ######################################################Forecast
+            filter_slots = cc_filter_slots.copy()
+            for cond in slots_conds:
+                filter_slots = filter_slots.loc[cond].copy()
+            all_filter_slots = filter_slots.groupby('Week End')['Slots'].sum()
+            if 'Undefined' in filter_slots['New/Follow Up'].values:
+                no_undef_filter_slots = (filter_slots.loc[
+                                       filter_slots['New/Follow Up'] != 'Undefined']
+                                       .groupby('Week End')['Slots'].sum())
+            else:
+                no_undef_filter_slots = all_filter_slots.copy()
+
+            WL_inc_undef = WL_start
+            WL_exc_undef = WL_start
+            for week in fut_weeks:
+                try:
+                    slots_inc_undef = all_filter_slots.loc[week].copy()
+                except:
+                    slots_inc_undef = 0
+                new_WL_inc_undef = max(WL_inc_undef + adds - slots_inc_undef, 0)
+                WL_inc_undef = new_WL_inc_undef
+                output_table.append(
+                            [week, spec, cc, prior, N_FU, 'Y', week+main_lookup+'Y',
+                             round(new_WL_inc_undef), round(adds), slots_inc_undef,
+                             'Forecast'])
+                try:
+                    slots_exc_undef = no_undef_filter_slots.loc[week]
+                except:
+                    slots_exc_undef = 0
+                new_WL_exc_undef = max(WL_exc_undef + adds - slots_exc_undef, 0)
+                WL_exc_undef = new_WL_exc_undef
+                output_table.append(
+                            [week, spec, cc, prior, N_FU, 'N', week+main_lookup+'N',
+                             round(new_WL_exc_undef), round(adds), slots_exc_undef,
+                             'Forecast'])
+
+    return pd.DataFrame(output_table,
+                        columns=['Week End', 'Specialty', 'Clinic Code',
+                                 'Priority', 'New/Follow Up',
+                                 'Including Undefined', 'Lookup Col',
+                                 'Waitlist Size', 'Waitlist Additions',
+                                 'Attendances', 'Past/Future'])
+
+def check_golden(wl_full_dataset, cancer_wl, cancer_slots, fut_weeks):
+    #Function to check the model's output is exactly the same as the golden
+    #output, values, types and row order. Raises an AssertionError showing the
+    #first difference if not.
+    pd.testing.assert_frame_equal(wl_full_dataset,
+                                  reference_dataset(cancer_wl, cancer_slots,
+                                                    fut_weeks))
+
+def check_cache(add, att, wl, pfmgt_spec, cancer_slots, chunksize=100):
+    #Function to check the extract cache, in default and low memory mode. The
+    #sources are put in SQLite without their last week and extracted, then
+    #the last week is added, along with the rest of the week before it (the
+    #cache's watermark week, so the second pull has to replace it), and
+    #extracted again from the cache. The merged sources must match a full
+    #pull. Raises an AssertionError showing the first difference if not.
+    history = {'add': add, 'att': att, 'wl': wl}
+    last_weeks = sorted(add['Week End'].unique())[-2:]
+    #Rows only in the database for the second pull
+    later = {name: (df['Week End'] == last_weeks[1])
+                   | ((df['Week End'] == last_weeks[0]) & (df.index % 2 == 1))
+             for name, df in history.items()}
+    queries = {name: f'SELECT * FROM "{name}" WHERE "Week End" >= :since'
+               for name in history}
+    queries.update({name: f'SELECT * FROM "{name}"'
+                    for name in ['pfmgt_spec', 'cancer_slots']})
+    rundate_sql = {'add': None, 'att': 'SELECT MAX(rundate) FROM "att"',
+                   'wl': 'SELECT MAX(rundate) FROM "wl"'}
+    for low_memory in [False, True]:
+        kwargs = ({'chunksize': chunksize, 'key_cols': JOIN_COLS}
+                  if low_memory else {})
+        with tempfile.TemporaryDirectory() as out_dir:
+            engine = create_engine(f'sqlite:///{os.path.join(out_dir, "sources.db")}')
+            for name, df in history.items():
+                df.loc[~later[name]].to_sql(name, engine, index=False)
+            pfmgt_spec.to_sql('pfmgt_spec', engine, index=False)
+            cancer_slots.to_sql('cancer_slots', engine, index=False)
+            cache_dir = os.path.join(out_dir, 'Cache')
+            extract_with_cache(queries, engine, cache_dir, rundate_sql,
+                               **kwargs)
+            for name, df in history.items():
+                df.loc[later[name]].to_sql(name, engine, index=False,
+                                           if_exists='append')
+            sources, _ = extract_with_cache(queries, engine, cache_dir,
+                                            rundate_sql, **kwargs)
+            full, _ = extract_sources(queries, engine,
+                                      params={name: {'since': FULL_HISTORY}
+                                              for name in history}, **kwargs)
+            engine.dispose()
+        for name in queries:
+            merged, pulled = [df.astype({col: object for col in df
+                                         if isinstance(df[col].dtype,
+                                                       pd.CategoricalDtype)})
+                                .sort_values(list(df.columns))
+                                .reset_index(drop=True)
+                              for df in [sources[name], full[name]]]
+            pd.testing.assert_frame_equal(merged, pulled)
+
+def check_scenario_bands(cancer_wl, cancer_slots, fut_weeks, n_sims=100):
+    #Function to check the simulated bands of the Baseline scenario are the
+    #same as a forecast without scenarios, so adding or removing other
+    #scenarios doesn't change them. Raises an AssertionError showing the first
+    #difference if not.
+    bands = [f'Waitlist P{percentile}' for percentile in SIMULATION_PERCENTILES]
+    store = build_week_store(weekly_grouping_sets(cancer_wl, STORE_METRICS))
+    start = scenario_start_points(store)
+    scenarios = pd.DataFrame({'Scenario': ['Baseline', 'More Slots',
+                                           'More Additions'],
+                              'Slots Multiplier': [1, 1.5, 1],
+                              'Additions Offset': [0, 0, 2]})
+    baseline = forecast_dataset(start, cancer_wl, store, cancer_slots,
+                                fut_weeks, n_sims=n_sims)
+    with_scenarios = forecast_dataset(start, cancer_wl, store, cancer_slots,
+                                      fut_weeks, scenarios, n_sims)
+    pd.testing.assert_frame_equal(
+        with_scenarios.loc[with_scenarios['Scenario'] == 'Baseline', bands]
+                      .reset_index(drop=True),
+        baseline.loc[baseline['Past/Future'] == 'Forecast', bands]
+                .reset_index(drop=True))
+
+
+################################################################################
+                            #####Benchmark#####
+################################################################################
+def measure(stages, stage, trace, func, *args, **kwargs):
+    #Function to run one stage of the model, recording how long it took and,
+    #if trace is True, the peak memory it allocated. Memory tracing slows the
+    #stage down, so times and memory are taken from separate runs.
+    if trace:
+        tracemalloc.start()
+    t = time.perf_counter()
+    result = func(*args, **kwargs)
+    secs = time.perf_counter() - t
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stages[stage] = peak / 1e6
+    else:
+        stages[stage] = secs
+    return result
+
+def prepare_sources(add, att, wl, pfmgt_spec, cancer_slots, low_memory=False):
+    #Function to do the model's pre-processing and joins of the raw sources,
+    #returns cancer_wl, cancer_slots and the forecast weeks. With low_memory
+    #the sources are shrunk first, with categorical keys and 'YYYY-MM-DD'
+    #dates, as the low memory loader does.
+    wl = wl.copy()
+    wl['Week End'] = wl['Week End'].astype('datetime64[ns]')
+    if low_memory:
+        add, att, wl, pfmgt_spec, cancer_slots = [
+            shrink_frame(df.copy(), JOIN_COLS)
+            for df in [add, att, wl, pfmgt_spec, cancer_slots]]
+    wl['Specialty Code'] = str_strip(wl['Specialty Code'])
+    cancer_wl = combine_sources(add, att, wl, pfmgt_spec)
+    cancer_slots = cancer_slots.copy()
+    cancer_slots['Week End'] = cancer_slots['Week End'].astype(str)
+    fut_weeks = (cancer_slots['Week End'].drop_duplicates().sort_values()
+                                         .astype(str).values.tolist())
+    return cancer_wl, cancer_slots, fut_weeks
+
+def run_stages(sources, out_dir, trace=False, low_memory=False):
+    #Function to run each stage of the model on the synthetic sources, the same
+    #way the model script does. Extraction reads the sources back from a local
+    #SQLite copy, the rest of the model carries on from the generated frames
+    #as SQLite doesn't keep the date types. low_memory runs it as the model's
+    #--low-memory mode does. Returns {stage: seconds}, or {stage: peak MB} if
+    #trace is True, and the full dataset with every grouping's rows (duplicate
+    #groupings copied back from their aliases).
+    stages = {}
+    engine = create_engine(f'sqlite:///{os.path.join(out_dir, "sources.db")}')
+    measure(stages, 'extract', trace, extract_sources,
+            {name: f'SELECT * FROM "{name}"' for name in sources}, engine,
+            **({'chunksize': 100000, 'key_cols': JOIN_COLS} if low_memory
+               else {}))
+    engine.dispose()
+    cancer_wl, cancer_slots, fut_weeks = measure(stages, 'combine', trace,
+                                                 prepare_sources,
+                                                 *sources.values(), low_memory)
+    weekly = measure(stages, 'weekly', trace, weekly_grouping_sets, cancer_wl,
+                     ['Waitlist Size', 'Waitlist Additions', 'Attendances'])
+    store = measure(stages, 'store', trace, build_week_store, weekly)
+    start = measure(stages, 'rollup', trace, scenario_start_points, store)
+    start['Waitlist Additions'] = measure(stages, 'estimate', trace,
+                                          estimate_additions, store)['mean']
+    situations, aliases = measure(stages, 'dedupe', trace, dedupe_situations,
+                                  start, cancer_wl, cancer_slots, fut_weeks)
+    wl_full_dataset = measure(stages, 'forecast', trace, forecast_dataset,
+                              situations, cancer_wl, store, cancer_slots,
+                              fut_weeks)
+    measure(stages, 'excel', trace, write_workbook, wl_full_dataset,
+            os.path.join(out_dir, 'Cancer WL Forecast.xlsx'), aliases=aliases)
+    return stages, expand_aliases(wl_full_dataset, aliases)
+
+def benchmark(scales, golden_scales=(), seed=0, cache_scales=()):
+    #Function to time and memory profile each stage at each scale, and check
+    #the output against the golden output at golden_scales (the golden output
+    #is slow to make, so only check it at smaller scales, along with the
+    #scenario bands) and the extract cache at cache_scales. Returns a table of seconds and peak MB by scale
+    #and stage.
+    results = []
+    for name, scale in scales.items():
+        sources = dict(zip(['add', 'att', 'wl', 'pfmgt_spec', 'cancer_slots'],
+                           synthetic_sources(**scale, seed=seed)))
+        with tempfile.TemporaryDirectory() as out_dir:
+            engine = create_engine(f'sqlite:///{os.path.join(out_dir, "sources.db")}')
+            for source, df in sources.items():
+                df.to_sql(source, engine, index=False)
+            engine.dispose()
+            secs, wl_full_dataset = run_stages(sources, out_dir)
+            peak_mb, _ = run_stages(sources, out_dir, trace=True)
+            if name in golden_scales:
+                _, low_memory_dataset = run_stages(sources, out_dir,
+                                                   low_memory=True)
+        if name in golden_scales:
+            check_golden(wl_full_dataset, *prepare_sources(*sources.values()))
+            check_golden(low_memory_dataset,
+                         *prepare_sources(*sources.values()))
+            print(f'{name}: matches golden output, in default and low memory '
+                  'mode')
+            check_scenario_bands(*prepare_sources(*sources.values()))
+            print(f'{name}: baseline bands match a run without scenarios')
+        if name in cache_scales:
+            check_cache(*sources.values())
+            print(f'{name}: cached extract matches a full pull')
+        for stage in secs:
+            results.append({'Scale': name, 'Stage': stage,
+                            'Rows': len(wl_full_dataset),
+                            'Seconds': round(secs[stage], 3),
+                            'Peak MB': round(peak_mb[stage], 1)})
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the cancer wait '
+                                     'list model on synthetic data')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'],
+                        choices=list(SCALES) + ['custom'])
+    parser.add_argument('--golden', nargs='*', default=['small'],
+                        help='scales to check against the golden output')
+    parser.add_argument('--cache', nargs='*', default=[],
+                        help='scales to check the extract cache at, pulling '
+                        'from SQLite twice in default and low memory mode')
+    parser.add_argument('--specialties', type=int, default=10,
+                        help='number of specialties for the custom scale')
+    parser.add_argument('--clinic-codes', type=int, default=100,
+                        help='number of clinic codes for the custom scale')
+    parser.add_argument('--priorities', type=int, default=4,
+                        choices=range(1, len(PRIORITIES) + 1),
+                        help='number of priorities for the custom scale')
+    parser.add_argument('--weeks', type=int, default=6,
+                        help='number of past weeks for the custom scale')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    SCALES['custom'] = {'n_specialties': args.specialties,
+                        'n_clinic_codes': args.clinic_codes,
+                        'n_priorities': args.priorities,
+                        'n_weeks': args.weeks}
+    results = benchmark({name: SCALES[name] for name in args.scales},
+                        args.golden, args.seed, args.cache)
+    print(results.pivot(index='Stage', columns='Scale',
+                        values=['Seconds', 'Peak MB'])
+                 .reindex(results['Stage'].drop_duplicates()).to_string())
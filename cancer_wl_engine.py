@@ -0,0 +1,892 @@
+import os
+import json
+import pandas as pd
+import numpy as np
+import hashlib
+from itertools import combinations
+
+################################################################################
+                        #####Data Types and Joining#####
+################################################################################
+#Columns the sources are joined on
+JOIN_COLS = ['Week End', 'Specialty Code', 'Clinic Code', 'Priority',
+             'New/Follow Up']
+
+def share_categories(frames, cols):
+    #Function to give a column the same categories in every frame it appears
+    #in, so the frames can be joined/concatenated on the category codes rather
+    #than the strings. Categories are sorted so grouping by them gives the same
+    #order as grouping by the strings. Frames are changed in place.
+    for col in cols:
+        values = [frame[col] for frame in frames if col in frame]
+        if not values:
+            continue
+        categories = sorted(set().union(*[
+                            value.cat.categories if isinstance(value.dtype, pd.CategoricalDtype)
+                            else value.dropna().unique() for value in values]))
+        dtype = pd.CategoricalDtype(categories)
+        for frame in frames:
+            if col in frame:
+                frame[col] = frame[col].astype(dtype)
+
+def str_strip(series):
+    #Function to strip whitespace from a column of strings. If the column is
+    #categorical only the categories are stripped, so it stays categorical.
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.str.strip()
+    stripped = series.cat.categories.str.strip()
+    categories = pd.Index(sorted(stripped.unique()))
+    codes = np.append(categories.get_indexer(stripped), -1)[series.cat.codes]
+    return pd.Series(pd.Categorical.from_codes(codes, categories),
+                     index=series.index, name=series.name)
+
+def combine_sources(add, att, wl, pfmgt_spec):
+    #Function to join the additions, attendances and waitlist sizes together,
+    #then add the specialty descriptions. If the key columns are categorical
+    #they are given the same categories first, so the joins are done on the
+    #codes.
+    codes = isinstance(wl['Clinic Code'].dtype, pd.CategoricalDtype)
+    if codes:
+        share_categories([add, att, wl, pfmgt_spec], JOIN_COLS + ['Specialty'])
+    cancer_wl = (wl
+                    .merge(add
+                        .merge(att, on=JOIN_COLS, how='outer'),
+                    on=JOIN_COLS, how='outer'))
+    #The outer merges sort the keys, but categorical keys are sorted by code,
+    #so missing keys (code -1) come first rather than last as they do for
+    #strings. Put them last so the rows are in the same order either way.
+    if codes:
+        cancer_wl = (cancer_wl.sort_values(JOIN_COLS, na_position='last',
+                                           kind='stable')
+                              .reset_index(drop=True))
+
+    #Merge onto specialty descriptions, ensure no unwanted specialties are included
+    cancer_wl = cancer_wl.merge(pfmgt_spec, on='Specialty Code', how='left')
+    cancer_wl = cancer_wl.loc[~cancer_wl['Specialty Code'].isin(['ZZ','ZN','99'])]
+    #Make date column string (categorical dates are already strings)
+    if not isinstance(cancer_wl['Week End'].dtype, pd.CategoricalDtype):
+        cancer_wl['Week End'] = cancer_wl['Week End'].astype(str)
+    cancer_wl['Priority'] = str_strip(cancer_wl['Priority'])
+    cancer_wl['Past/Future'] = 'Past'
+    if codes:
+        cancer_wl['Past/Future'] = cancer_wl['Past/Future'].astype('category')
+    return cancer_wl
+
+
+################################################################################
+                                #####Sites#####
+################################################################################
+#In batch mode the sources are pulled once for several sites (providers) and
+#split between them. The slots come with their site, the history is split by
+#clinic code, each clinic code going to the site it has most sessions at.
+
+#Providers (sites) the slots are pulled for, unless --sites is given
+DEFAULT_SITES = ['RK900']
+
+def clinic_code_sites(site_clinics):
+    #Function to get the site of every clinic code from a table of the
+    #sessions each site has had in each clinic code, as {clinic code: site}.
+    busiest = (site_clinics.astype({'Site': object, 'Clinic Code': object})
+                           .sort_values(['Sessions', 'Site'],
+                                        ascending=[False, True], kind='stable')
+                           .drop_duplicates('Clinic Code'))
+    return dict(zip(busiest['Clinic Code'], busiest['Site']))
+
+def split_sites(cancer_wl, cancer_slots, site_clinics, sites):
+    #Function to split the combined history and slots of several sites into
+    #each site's own, in one pass over each. History rows for clinic codes
+    #not at any of the sites are left out. Returns {site: (cancer_wl,
+    #cancer_slots)} for the sites with any history.
+    wl_site = (cancer_wl['Clinic Code'].astype(object)
+                                       .map(clinic_code_sites(site_clinics)))
+    unmatched = wl_site.isna().sum()
+    if unmatched:
+        print(f'{unmatched} history rows have a clinic code not at any site, '
+              'left out')
+    wl_parts = {site: df.reset_index(drop=True) for site, df
+                in cancer_wl.groupby(wl_site.values, sort=False)}
+    slots_parts = {site: df.reset_index(drop=True) for site, df
+                   in cancer_slots.groupby(cancer_slots['Site'].astype(object)
+                                                               .values,
+                                           sort=False)}
+    return {site: (wl_parts[site], slots_parts.get(site, cancer_slots.iloc[:0]))
+            for site in sites if site in wl_parts}
+
+
+################################################################################
+                          #####Grouping Sets#####
+################################################################################
+#Columns the dashboard can filter on, in the order they appear in 'start'
+GROUPING_COLS = ['Specialty', 'Clinic Code', 'Priority', 'New/Follow Up']
+
+#Every combination of the filter columns. 'All' data first, then one column
+#filtering, two column filtering etc. This is the same order the old
+#aggregation() calls were concatenated in, so 'start' keeps its row order.
+GROUPING_SETS = [list(cols) for n in range(len(GROUPING_COLS) + 1)
+                 for cols in combinations(GROUPING_COLS, n)]
+
+def weekly_grouping_sets(cancer_wl, measures):
+    #Function to sum the measures for each grouping for each week, for every
+    #grouping set in GROUPING_SETS. Only the finest (all 4 columns) set is
+    #calculated from the raw data, every coarser set is rolled up from the
+    #smallest set one column finer than it. Missing keys are kept
+    #(dropna=False) while rolling up so coarser sets that don't filter on that
+    #column still count those rows, they are only dropped from the sets that
+    #actually group on that column.
+    weekly = {tuple(GROUPING_COLS): (cancer_wl
+                                    .groupby(GROUPING_COLS + ['Week End'],
+                                             dropna=False, observed=True,
+                                             as_index=False)[measures].sum())}
+    for cols in sorted(GROUPING_SETS, key=len, reverse=True):
+        if tuple(cols) in weekly:
+            continue
+        parent = min((df for key, df in weekly.items()
+                      if len(key) == len(cols) + 1 and set(cols) <= set(key)),
+                     key=len)
+        weekly[tuple(cols)] = (parent.groupby(cols + ['Week End'], dropna=False,
+                                              observed=True, as_index=False)
+                                     [measures].sum())
+
+    #Now remove the missing keys for each set, as the groupby would have done
+    return {tuple(cols): weekly[tuple(cols)].loc[weekly[tuple(cols)][cols]
+                                                 .notna().all(axis=1)]
+            for cols in GROUPING_SETS}
+
+
+################################################################################
+                              #####Week Store#####
+################################################################################
+#Every grouping's weekly totals in one dense (situation, week, metric) array,
+#built once from the grouping sets' weekly totals so the later stages slice it
+#rather than grouping or matching strings. Weeks are integer ordinals (weeks
+#since 1970), and every week from the first to the last is a column, nan where
+#a situation has no data. The store is a dict of 'situations' (the grouping
+#columns of each row, in the order start has them), 'weeks' (the ordinal of
+#each column), 'week_ends' (the 'YYYY-MM-DD' of each column), 'metrics' and
+#'values'. It is saved as .npy, so reruns and workers memory map it from disk
+#instead of reading and parsing it again.
+STORE_METRICS = ['Waitlist Size', 'Waitlist Additions', 'Attendances']
+
+def week_days(week_ends):
+    #Function to turn week end dates (or 'YYYY-MM-DD' strings) into days
+    #since 1970
+    return (pd.to_datetime(pd.Series(week_ends).astype(str)).values
+              .astype('datetime64[D]').astype(np.int64))
+
+def week_ordinals(week_ends):
+    #Function to turn week end dates into integer week ordinals, so weeks
+    #are compared and lined up as numbers. Week ends 7 days apart are always
+    #consecutive ordinals.
+    return week_days(week_ends) // 7
+
+def build_week_store(weekly, metrics=STORE_METRICS):
+    #Function to build the store from the weekly totals of every grouping set
+    #(see weekly_grouping_sets), in one pass over each set. Situations are in
+    #the order of GROUPING_SETS and then their keys, the same as start.
+    keys = []
+    parts = []
+    for cols in GROUPING_SETS:
+        df = weekly.get(tuple(cols))
+        if df is None or not len(df):
+            continue
+        group = (df.groupby(cols, observed=True, sort=False).ngroup().values
+                 if cols else np.zeros(len(df), dtype=int))
+        groups = (df[cols].drop_duplicates().values.tolist() if cols else [()])
+        parts.append((len(keys) + group, week_days(df['Week End']),
+                      df[metrics].to_numpy(dtype=float)))
+        keys += [situation_key(cols, tuple(key)) for key in groups]
+    #Weeks are put in columns by their days from the first week, so a week end
+    #on another weekday would silently share a column with its neighbour
+    all_days = np.concatenate([days for _, days, _ in parts]
+                              + [np.zeros(0, dtype=np.int64)])
+    weekdays, first = np.unique(all_days % 7, return_index=True)
+    if len(weekdays) > 1:
+        examples = pd.to_datetime(all_days[first], unit='D').strftime('%Y-%m-%d')
+        raise ValueError(f'Week ends {", ".join(examples)} are on different '
+                         'weekdays, so they can\'t be put in one week store')
+    first_day = min([days.min() for _, days, _ in parts], default=0)
+    n_weeks = max([(days.max() - first_day) // 7 + 1 for _, days, _ in parts],
+                  default=0)
+    values = np.full((len(keys), n_weeks, len(metrics)), np.nan)
+    for rows, days, part_values in parts:
+        values[rows, (days - first_day) // 7] = part_values
+    days = first_day + 7 * np.arange(n_weeks)
+    return {'situations': pd.DataFrame(keys, columns=GROUPING_COLS, dtype=object),
+            'weeks': days // 7,
+            'week_ends': days.astype('datetime64[D]').astype(str).astype(object),
+            'metrics': list(metrics),
+            'values': values}
+
+def save_week_store(store, folder):
+    #Function to save the store to a folder, the values as .npy so they can
+    #be memory mapped and the rest as JSON. Returns the folder.
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, 'values.npy'), store['values'])
+    with open(os.path.join(folder, 'store.json'), 'w') as f:
+        json.dump({'situations': store['situations'].values.tolist(),
+                   'weeks': store['weeks'].tolist(),
+                   'week_ends': store['week_ends'].tolist(),
+                   'metrics': store['metrics']}, f)
+    return folder
+
+def open_week_store(folder, mmap_mode='r'):
+    #Function to open a saved store. The values are memory mapped (read only)
+    #by default, so only the parts sliced out are read from disk.
+    with open(os.path.join(folder, 'store.json'), 'r') as f:
+        meta = json.load(f)
+    return {'situations': pd.DataFrame(meta['situations'], columns=GROUPING_COLS,
+                                       dtype=object),
+            'weeks': np.array(meta['weeks'], dtype=np.int64),
+            'week_ends': np.array(meta['week_ends'], dtype=object),
+            'metrics': meta['metrics'],
+            'values': np.load(os.path.join(folder, 'values.npy'),
+                              mmap_mode=mmap_mode)}
+
+def store_rows(store, keys):
+    #Function to get the store row of each situation key, -1 if it isn't in
+    #the store
+    position = {key: i for i, key in
+                enumerate(zip(*[store['situations'][col] for col in GROUPING_COLS]))}
+    return np.array([position.get(tuple(key), -1) for key in keys], dtype=int)
+
+def store_metric(store, metric):
+    #Function to get one metric of every situation in the store, as a
+    #(situation, week) array
+    return store['values'][:, :, store['metrics'].index(metric)]
+
+def situation_weekly(situations, store, metric):
+    #Function to get one metric of every situation for every week in the
+    #store, lined up by week. Returns a (situation, week) array, nan where a
+    #situation has no data that week (or isn't in the store).
+    rows = store_rows(store, zip(*[situations[col] for col in GROUPING_COLS]))
+    values = np.full((len(rows), len(store['weeks'])), np.nan)
+    values[rows >= 0] = store['values'][rows[rows >= 0], :,
+                                        store['metrics'].index(metric)]
+    return values
+
+def scenario_start_points(store):
+    #Function to get the end wait list size and average additions to start
+    #the forecasts on for every possible filtering in the data, from the
+    #store: the wait list size of each situation's latest week with data and
+    #the mean additions of its weeks with data. Nans are filled with 0, and
+    #the groupings not filtered on are 'All'.
+    wl_size = np.asarray(store_metric(store, 'Waitlist Size'))
+    #Column of each situation's latest week with data
+    latest = wl_size.shape[1] - 1 - np.argmax(~np.isnan(wl_size[:, ::-1]), axis=1)
+    start = pd.DataFrame({'Waitlist Size': wl_size[np.arange(len(wl_size)), latest],
+                          'Waitlist Additions': mean_additions(
+                              np.asarray(store_metric(store, 'Waitlist Additions')))})
+    start[['Waitlist Size',
+           'Waitlist Additions']] = start[['Waitlist Size',
+                                           'Waitlist Additions']].fillna(0)
+    return pd.concat([start, store['situations'][GROUPING_COLS].astype(object)],
+                     axis=1)
+
+
+################################################################################
+                          #####Additions Estimators#####
+################################################################################
+#Ways of estimating each grouping's weekly additions to forecast with, all
+#worked out at once from the store's dense (situation, week) array of weekly
+#additions, with nan for weeks a situation has no data. Each takes that array
+#and a window of weeks and returns one value per situation, nan if it has no
+#additions in the weeks it uses.
+#Weeks the rolling, ewma and seasonal estimators average over, the L6W
+ESTIMATOR_WINDOW = 6
+#Weeks back to the same week last year
+WEEKS_PER_YEAR = 52
+
+def weeks_mean(adds):
+    #Function to get the mean of each situation's weeks with data, nan if none
+    n_weeks = (~np.isnan(adds)).sum(axis=1)
+    return np.divide(np.nansum(adds, axis=1), n_weeks,
+                     out=np.full(len(adds), np.nan), where=n_weeks > 0)
+
+def mean_additions(adds, window=ESTIMATOR_WINDOW):
+    #Function to average every week with data, as the rollup always has
+    return weeks_mean(adds)
+
+def rolling_additions(adds, window=ESTIMATOR_WINDOW):
+    #Function to average the weeks with data in the last window weeks
+    return weeks_mean(adds[:, -window:])
+
+def ewma_additions(adds, window=ESTIMATOR_WINDOW):
+    #Function to get an exponentially weighted mean, with a span of window
+    #weeks. Weights fall off by calendar week back from the latest week, so
+    #a missing week still counts as a week older.
+    decay = 1 - 2 / (window + 1)
+    weights = np.where(np.isnan(adds), 0,
+                       decay ** np.arange(adds.shape[1])[::-1])
+    total_weight = weights.sum(axis=1)
+    return np.divide((weights * np.nan_to_num(adds)).sum(axis=1), total_weight,
+                     out=np.full(len(adds), np.nan), where=total_weight > 0)
+
+def seasonal_additions(adds, window=ESTIMATOR_WINDOW):
+    #Function to average the additions in the same window weeks last year as
+    #the window weeks after the latest week, falling back to the rolling mean
+    #for situations with no data a year back.
+    first = adds.shape[1] - WEEKS_PER_YEAR
+    last_year = weeks_mean(adds[:, max(first, 0):max(first + window, 0)])
+    return np.where(np.isnan(last_year), rolling_additions(adds, window),
+                    last_year)
+
+ESTIMATORS = {'mean': mean_additions,
+              'rolling': rolling_additions,
+              'ewma': ewma_additions,
+              'seasonal': seasonal_additions}
+
+def estimate_additions(store, estimators=('mean',), window=ESTIMATOR_WINDOW):
+    #Function to estimate the weekly additions of every situation in the store
+    #with each of estimators (names in ESTIMATORS), all from the one slice of
+    #the store. Returns {name: array} with a value per situation in store
+    #order, 0 where it has no additions in the weeks used.
+    adds = np.asarray(store_metric(store, 'Waitlist Additions'))
+    return {name: np.nan_to_num(ESTIMATORS[name](adds, window))
+            for name in estimators}
+
+
+################################################################################
+                            #####Forecasting#####
+################################################################################
+def forecast_waitlist(wl_start, adds, slots):
+    #Function to forecast the waitlist size for every grouping at once. wl_start
+    #and adds have one value per grouping, slots has one row per grouping and one
+    #column per future week (extra leading dimensions, e.g. including/excluding
+    #undefined, are broadcast). Each week is max(WL + adds - slots, 0) for all
+    #groupings together, in the same order of operations as the old loop so
+    #the results match it exactly.
+    slots = np.asarray(slots, dtype=float)
+    wl = np.broadcast_to(np.asarray(wl_start, dtype=float), slots.shape[:-1])
+    adds = np.asarray(adds, dtype=float)
+    fut_wl = np.empty(slots.shape)
+    for week in range(slots.shape[-1]):
+        wl = np.maximum(wl + adds - slots[..., week], 0)
+        fut_wl[..., week] = wl
+    return fut_wl
+
+#What-if scenarios are a table with a row per scenario, named in 'Scenario',
+#with any of these columns to change the slots and additions (missing columns
+#leave them as they are).
+SCENARIO_DEFAULTS = {'Slots Multiplier': 1, 'Slots Offset': 0,
+                     'Additions Multiplier': 1, 'Additions Offset': 0}
+
+def scenario_setting(scenarios, col):
+    #Function to get one of the scenario settings for every scenario, with the
+    #default where it isn't given.
+    if col in scenarios:
+        values = scenarios[col].fillna(SCENARIO_DEFAULTS[col])
+    else:
+        values = np.full(len(scenarios), SCENARIO_DEFAULTS[col])
+    return np.asarray(values, dtype=float)
+
+def scenario_inputs(scenarios, adds, slots):
+    #Function to get the additions and slots of every grouping under every
+    #scenario, as (scenario, grouping) and (scenario, ..., grouping, week)
+    #arrays. Each scenario's slots and additions are value * multiplier +
+    #offset, applied to each grouping's weekly figure and kept to at least 0.
+    slots = np.asarray(slots, dtype=float)
+    extra_dims = (1,) * slots.ndim
+    scenario_slots = np.maximum(
+                        slots * scenario_setting(scenarios, 'Slots Multiplier')
+                                .reshape(-1, *extra_dims)
+                        + scenario_setting(scenarios, 'Slots Offset')
+                          .reshape(-1, *extra_dims), 0)
+    scenario_adds = np.maximum(
+                        np.asarray(adds, dtype=float)
+                        * scenario_setting(scenarios, 'Additions Multiplier')[:, None]
+                        + scenario_setting(scenarios, 'Additions Offset')[:, None],
+                        0)
+    return scenario_adds, scenario_slots
+
+#Percentiles of the simulated wait list reported for each forecast week
+SIMULATION_PERCENTILES = [10, 50, 90]
+
+def simulation_seeds(wl_start, adds_history, slots, seed=0):
+    #Function to get a random seed for each grouping from its data: start wait
+    #list size, weekly additions history and slots (as for forecast_waitlist,
+    #before any scenario changes them). Groupings with the same data get the
+    #same seed, so a duplicate grouping (see dedupe_situations) is simulated
+    #the same as the one it is stored under, and a grouping's baseline is
+    #simulated the same whatever scenarios run with it. seed picks a different
+    #set of seeds for every grouping.
+    wl_start = np.asarray(wl_start, dtype=float)
+    adds_history = np.asarray(adds_history, dtype=float)
+    slots = np.moveaxis(np.asarray(slots, dtype=float), -2, 0)
+    return np.array([int.from_bytes(hashlib.blake2b(
+                         wl_start[i:i + 1].tobytes() + adds_history[i].tobytes()
+                         + slots[i].tobytes(), digest_size=4).digest(), 'little')
+                     + seed * 2**32 for i in range(len(wl_start))],
+                    dtype=np.uint64)
+
+def simulate_waitlist(wl_start, adds_history, slots, seeds, n_sims=1000,
+                      adds_multiplier=1, adds_offset=0,
+                      percentiles=SIMULATION_PERCENTILES, max_cells=20000000):
+    #Function to simulate the waitlist of every grouping n_sims times, with
+    #each week's additions resampled from that grouping's own weekly additions
+    #history, and get percentiles of the simulated waitlist for every week.
+    #adds_history is a (grouping, past week) array of weekly additions with
+    #missing weeks as nan, slots is as for forecast_waitlist (any leading
+    #dimensions, e.g. scenario and including/excluding undefined, are kept).
+    #seeds has a random seed for each grouping, so a grouping's simulations
+    #are the same however the groupings are split up or ordered.
+    #adds_multiplier and adds_offset are applied to the resampled additions,
+    #and broadcast against the leading dimensions of slots. Each simulation
+    #is the same max(WL + adds - slots, 0) recursion as the forecast. Every
+    #leading dimension uses the same resampled additions, so differences
+    #between scenarios aren't down to chance. Groupings are simulated a chunk
+    #at a time, so no more than max_cells values are held at once. Returns a
+    #(percentile, ..., grouping, week) array.
+    slots = np.asarray(slots, dtype=float)
+    lead_shape, (n_groups, n_weeks) = slots.shape[:-2], slots.shape[-2:]
+    wl_start = np.asarray(wl_start, dtype=float)
+    adds_multiplier = np.asarray(adds_multiplier, dtype=float).reshape(
+                        np.shape(adds_multiplier) + (1, 1))
+    adds_offset = np.asarray(adds_offset, dtype=float).reshape(
+                    np.shape(adds_offset) + (1, 1))
+    #Move each grouping's history to the front, so a random position below
+    #the number of weeks it has picks one of its weeks
+    n_hist = np.sum(~np.isnan(adds_history), axis=1)
+    order = np.argsort(np.isnan(adds_history), axis=1, kind='stable')
+    history = np.nan_to_num(np.take_along_axis(adds_history, order, axis=1))
+    if history.shape[1] == 0:
+        history = np.zeros((n_groups, 1))
+
+    result = np.empty((len(percentiles),) + slots.shape)
+    chunk = max(1, max_cells // max(1, n_sims * int(np.prod(lead_shape))))
+    for first in range(0, n_groups, chunk):
+        groups = np.arange(first, min(first + chunk, n_groups))
+        #Resampled additions, (grouping, week, simulation)
+        draws = np.stack([np.random.default_rng(seed).random((n_weeks, n_sims))
+                          for seed in seeds[groups]])
+        pick = np.floor(draws * n_hist[groups][:, None, None]).astype(int)
+        adds = history[groups[:, None, None], pick]
+        wl = np.broadcast_to(wl_start[groups][:, None],
+                             lead_shape + (len(groups), n_sims))
+        for week in range(n_weeks):
+            wl = np.maximum(wl + np.maximum(adds[:, week] * adds_multiplier
+                                            + adds_offset, 0)
+                            - slots[..., groups, week, None], 0)
+            result[..., groups, week] = np.percentile(wl, percentiles,
+                                                      axis=-1)
+    return result
+
+################################################################################
+                            #####Group Indexes#####
+################################################################################
+def situation_key(cols, values):
+    #Function to turn a grouping's key values into the full (Specialty, Clinic
+    #Code, Priority, New/Follow Up) key used by 'start', with 'All' for the
+    #columns that grouping doesn't filter on.
+    if not isinstance(values, tuple):
+        values = (values,)
+    key = dict(zip(cols, values))
+    return tuple(key.get(col, 'All') for col in GROUPING_COLS)
+
+def past_data_index(cancer_wl, store, situations):
+    #Function to build a lookup of the past data of every situation in
+    #situations, so each situation doesn't need to filter the full dataset.
+    #Groupings with more than 6 rows of data are sliced from the store's
+    #weekly totals, smaller ones keep their individual rows from cancer_wl (as
+    #they were never aggregated). Every situation's rows are stacked one after
+    #the other, returns a dict of {situation key: (first row, last row + 1)},
+    #the weeks of every row and the [Waitlist Size, Waitlist Additions,
+    #Attendances] of every row.
+    measures = ['Waitlist Size', 'Waitlist Additions', 'Attendances']
+    keys = list(zip(*[situations[col] for col in GROUPING_COLS]))
+    #Only the grouping sets the situations are filtered on are looked at
+    used_sets = {tuple(col for col, value in zip(GROUPING_COLS, key)
+                       if value != 'All') for key in keys}
+    index = {}
+    weeks = []
+    values = []
+    n_rows_so_far = 0
+    for cols in GROUPING_SETS:
+        if tuple(cols) not in used_sets:
+            continue
+        if not cols:
+            small = cancer_wl.iloc[:len(cancer_wl) if len(cancer_wl) <= 6 else 0]
+        else:
+            #Number of rows each grouping would have been filtered down to
+            n_rows = (cancer_wl.groupby(cols, observed=True)[cols[0]]
+                               .transform('size'))
+            small = cancer_wl.loc[n_rows <= 6]
+        #Put each grouping's rows together, keeping them in order
+        group = (small.groupby(cols, observed=True, sort=False).ngroup().values
+                 if cols else np.zeros(len(small), dtype=int))
+        order = np.argsort(group, kind='stable')
+        _, first, count = np.unique(group[order], return_index=True,
+                                    return_counts=True)
+        for key, first_row, n in zip(small[cols].iloc[order[first]].values.tolist(),
+                                     first, count):
+            start = n_rows_so_far + first_row
+            index[situation_key(cols, tuple(key))] = (start, start + n)
+        weeks.append(np.asarray(small['Week End'], dtype=object)[order])
+        values.append(small[measures].to_numpy(dtype=float)[order])
+        n_rows_so_far += len(small)
+
+    #The rest are sliced from the store, a row for each week with data
+    large = [key for key in keys if key not in index]
+    rows = store_rows(store, large)
+    large = [key for key, row in zip(large, rows) if row >= 0]
+    store_values = np.asarray(store['values'][rows[rows >= 0]])[
+                    :, :, [store['metrics'].index(measure) for measure in measures]]
+    has_data = ~np.isnan(store_values[:, :, 0])
+    situation, week = np.nonzero(has_data)
+    count = has_data.sum(axis=1)
+    first = n_rows_so_far + np.cumsum(count) - count
+    index.update(zip(large, zip(first.tolist(), (first + count).tolist())))
+    weeks.append(store['week_ends'][week])
+    values.append(store_values[situation, week])
+    return index, np.concatenate(weeks), np.concatenate(values)
+
+def future_slots_index(cancer_slots, fut_weeks):
+    #Function to build a lookup of weekly slots for every specialty/clinic code
+    #grouping, split by New/Follow Up, so each situation's slots only need
+    #adding up from a few arrays. Each entry is {New/Follow Up: slots per week}.
+    index = {}
+    for cols in [[], ['Specialty Name'], ['Clinic Code'],
+                 ['Specialty Name', 'Clinic Code']]:
+        weekly_slots = (cancer_slots.groupby(cols + ['New/Follow Up', 'Week End'],
+                                             dropna=False, observed=True)
+                                    ['Slots'].sum()
+                                    .unstack('Week End', fill_value=0)
+                                    .reindex(columns=fut_weeks, fill_value=0))
+        for group, slots in zip(weekly_slots.index, weekly_slots.values):
+            key = situation_key([col.replace('Specialty Name', 'Specialty')
+                                 for col in cols] + ['New/Follow Up'], group)
+            index.setdefault(key[:2], {})[key[3]] = slots
+    return index
+
+def situation_slots(slots_index, spec, cc, N_FU, n_weeks):
+    #Function to get the weekly slots for one situation, including and
+    #excluding undefined. Undefined slots could be for either appointment type,
+    #so they are counted for any New/Follow Up filtering.
+    slots_inc_undef = np.zeros(n_weeks, dtype=int)
+    slots_exc_undef = np.zeros(n_weeks, dtype=int)
+    for slots_N_FU, slots in slots_index.get((spec, cc), {}).items():
+        if N_FU == 'All' or slots_N_FU in ['Undefined', N_FU]:
+            slots_inc_undef = slots_inc_undef + slots
+            if slots_N_FU != 'Undefined':
+                slots_exc_undef = slots_exc_undef + slots
+    return slots_inc_undef, slots_exc_undef
+
+
+################################################################################
+                          #####Duplicate Groupings#####
+################################################################################
+#Many groupings have exactly the same data as another, e.g. a clinic code that
+#only sees one specialty gives the same series for 'Specialty + Clinic Code'
+#as for 'Clinic Code' alone. These are only forecast and stored once, with an
+#alias table pointing every grouping's key at the key its data is stored under.
+def order_situations(start):
+    #Function to put the situations in the order they are forecast and stored,
+    #grouped by clinic code (biggest group).
+    return start.iloc[np.argsort(pd.factorize(start['Clinic Code'])[0],
+                                 kind='stable')]
+
+def grouping_rows(cancer_wl):
+    #Function to get the rows of cancer_wl in every grouping, as
+    #{situation key: bytes of its row numbers} so groupings can be compared.
+    positions = np.arange(len(cancer_wl))
+    rows = {}
+    for cols in GROUPING_SETS:
+        if not cols:
+            rows[situation_key(cols, ())] = positions.tobytes()
+            continue
+        #ngroup gives -1 for rows with a missing key, which aren't in a grouping
+        group = cancer_wl.groupby(cols, observed=True, sort=False).ngroup().values
+        found = group >= 0
+        group = group[found]
+        order = np.argsort(group, kind='stable')
+        _, first, count = np.unique(group[order], return_index=True,
+                                    return_counts=True)
+        group_rows = positions[found][order]
+        for key, first_row, n in zip(cancer_wl.loc[found, cols].iloc[order[first]]
+                                              .values.tolist(), first, count):
+            rows[situation_key(cols, tuple(key))] = (group_rows[first_row:
+                                                                first_row + n]
+                                                     .tobytes())
+    return rows
+
+def dedupe_situations(start, cancer_wl, cancer_slots, fut_weeks):
+    #Function to find the situations with the same data as an earlier one.
+    #Two situations are the same if they cover exactly the same rows of
+    #cancer_wl (so the same past data and start point) and have the same
+    #weekly slots including and excluding undefined (so the same forecast).
+    #This catches both functional dependencies (a clinic code only in one
+    #specialty, or only taking one priority) and any other groupings that
+    #happen to pick out the same rows. Returns the situations to forecast, in
+    #order, and an alias table of every situation's grouping columns, its
+    #lookup Key and the Block Key its data is stored under.
+    situations = order_situations(start)
+    keys = list(zip(*[situations[col] for col in GROUPING_COLS]))
+    rows = grouping_rows(cancer_wl)
+    slots_index = future_slots_index(cancer_slots, fut_weeks)
+    block_of = {}
+    block_keys = []
+    for key in keys:
+        spec, cc, prior, N_FU = key
+        slots_inc_undef, slots_exc_undef = situation_slots(slots_index, spec, cc,
+                                                           N_FU, len(fut_weeks))
+        fingerprint = (rows.get(key, key), slots_inc_undef.tobytes(),
+                       slots_exc_undef.tobytes())
+        block_keys.append(block_of.setdefault(fingerprint, key))
+    aliases = situations[GROUPING_COLS].astype(object).reset_index(drop=True)
+    aliases['Key'] = aliases[GROUPING_COLS].sum(axis=1)
+    aliases['Block Key'] = [''.join(key) for key in block_keys]
+    return (situations.loc[(aliases['Key'] == aliases['Block Key']).values],
+            aliases)
+
+def dataset_blocks(wl_full_dataset):
+    #Function to find each situation's block of rows in a full dataset, as
+    #{situation key: (first row, last row + 1)}. Each situation's rows are
+    #together.
+    if not len(wl_full_dataset):
+        return {}
+    main_lookup = sum((wl_full_dataset[col].values.astype(object)
+                       for col in GROUPING_COLS[1:]),
+                      wl_full_dataset[GROUPING_COLS[0]].values.astype(object))
+    block_starts = np.append(0, np.flatnonzero(main_lookup[1:] != main_lookup[:-1]) + 1)
+    block_ends = np.append(block_starts[1:], len(main_lookup))
+    return dict(zip(main_lookup[block_starts], zip(block_starts, block_ends)))
+
+def block_rows(first, last):
+    #Function to get the rows of a run of blocks, one after another, from each
+    #block's first and last + 1 row. Returns the rows and which block each
+    #row is from.
+    n_rows = last - first
+    block = np.repeat(np.arange(len(first)), n_rows)
+    rows = (np.arange(n_rows.sum()) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+            + first[block])
+    return rows, block
+
+def expand_aliases(wl_full_dataset, aliases):
+    #Function to rebuild the full dataset with every situation's rows, copying
+    #each alias's rows from the situation its data is stored under, as it
+    #would have been without removing duplicates.
+    blocks = dataset_blocks(wl_full_dataset)
+    first, last = np.array([blocks[key] for key in aliases['Block Key']]
+                           ).reshape(-1, 2).T
+    rows, alias = block_rows(first, last)
+    expanded = wl_full_dataset.iloc[rows].reset_index(drop=True)
+    for col in GROUPING_COLS:
+        expanded[col] = aliases[col].values[alias]
+    #Swap the stored key in the middle of Lookup Col for the alias's own key
+    expanded['Lookup Col'] = [week + key + lookup[len(week) + len(block_key):]
+                              for week, key, block_key, lookup in
+                              zip(expanded['Week End'],
+                                  aliases['Key'].values[alias],
+                                  aliases['Block Key'].values[alias],
+                                  expanded['Lookup Col'])]
+    return expanded
+
+
+################################################################################
+                        #####Incremental Recompute#####
+################################################################################
+#Most weeks only some groupings' data changes. Each situation's inputs are
+#fingerprinted, so only the situations whose fingerprint has changed since the
+#last run need forecasting again, and the rest are copied from its output.
+def forecast_indexes(situations, cancer_wl, store, cancer_slots, fut_weeks):
+    #Function to build the past data and future slots lookups for situations
+    #once, so they can be shared by situation_fingerprints and
+    #forecast_dataset (they also work for any subset of situations). Returns
+    #(past index, past weeks, past values, slots index).
+    return (*past_data_index(cancer_wl, store, situations),
+            future_slots_index(cancer_slots, fut_weeks))
+
+def situation_fingerprints(situations, cancer_wl, store, cancer_slots,
+                           fut_weeks, settings=(), indexes=None):
+    #Function to fingerprint everything a situation's rows of the full dataset
+    #are made from: its past data rows, start wait list size and additions,
+    #weekly slots including and excluding undefined, the forecast weeks and
+    #any settings for the whole run (scenarios, simulations etc). indexes can
+    #be given from forecast_indexes rather than built again. Returns
+    #{situation key: fingerprint}.
+    past_index, past_weeks, past_values, slots_index = (
+        indexes if indexes is not None
+        else forecast_indexes(situations, cancer_wl, store, cancer_slots,
+                              fut_weeks))
+    shared = repr((list(fut_weeks), settings)).encode()
+    keys = list(zip(*[situations[col] for col in GROUPING_COLS]))
+    fingerprints = {}
+    for key, wl_start, adds in zip(keys, situations['Waitlist Size'].values,
+                                   situations['Waitlist Additions'].values):
+        first, last = past_index.get(key, (0, 0))
+        fingerprint = hashlib.blake2b(shared, digest_size=16)
+        fingerprint.update('|'.join(map(str, past_weeks[first:last])).encode())
+        fingerprint.update(past_values[first:last].tobytes())
+        fingerprint.update(np.array([wl_start, adds], dtype=float).tobytes())
+        for slots in situation_slots(slots_index, key[0], key[1], key[3],
+                                     len(fut_weeks)):
+            fingerprint.update(slots.tobytes())
+        fingerprints[''.join(map(str, key))] = fingerprint.hexdigest()
+    return fingerprints
+
+def changed_situations(situations, fingerprints, previous_fingerprints):
+    #Function to find the situations whose fingerprint isn't the same as the
+    #last run's (including any that are new), returns a boolean array.
+    keys = situations[GROUPING_COLS].astype(object).sum(axis=1).values
+    return np.array([fingerprints[key] != previous_fingerprints.get(key)
+                     for key in keys], dtype=bool)
+
+def merge_forecasts(situations, changed_dataset, previous_dataset):
+    #Function to build the full dataset from the changed situations' new rows
+    #and the unchanged situations' rows from the last run, in the same order
+    #forecast_dataset gives. Either dataset can be None if nothing comes from
+    #it.
+    datasets = [df for df in [changed_dataset, previous_dataset]
+                if df is not None]
+    blocks = {}
+    offset = 0
+    for df in reversed(datasets):
+        blocks.update({key: (first + offset, last + offset) for key, (first, last)
+                       in dataset_blocks(df).items()})
+        offset += len(df)
+    #New rows take priority over the last run's
+    combined = pd.concat(datasets[::-1], ignore_index=True)
+    keys = order_situations(situations)[GROUPING_COLS].astype(object).sum(axis=1)
+    first, last = np.array([blocks[key] for key in keys]).reshape(-1, 2).T
+    rows, _ = block_rows(first, last)
+    return combined.iloc[rows].reset_index(drop=True)
+
+
+################################################################################
+                              #####Output#####
+################################################################################
+OUTPUT_COLS = ['Week End', 'Specialty', 'Clinic Code', 'Priority', 'New/Follow Up',
+               'Including Undefined', 'Lookup Col', 'Waitlist Size',
+               'Waitlist Additions', 'Attendances', 'Past/Future']
+
+def build_output(situations, past_rows, past_weeks, past_values, fut_weeks,
+                 fut_wl, slots, scenario_names=None, scenario_adds=None,
+                 bands=None):
+    #Function to build the full dataset a column at a time. Each situation gets
+    #a block of rows, its past data followed by a row for each future week
+    #including ('Y') then excluding ('N') undefined. situations has the
+    #grouping columns and additions of each situation in order, past_rows the
+    #(first row, last row + 1) of each situation's past data in past_weeks and
+    #past_values. fut_wl and slots are (including/excluding undefined,
+    #situation, week) arrays. If scenario_names are given, fut_wl and slots have
+    #a leading scenario dimension and scenario_adds has each scenario's
+    #additions. Each situation then has its forecast rows for each scenario in
+    #turn, with the scenario in an extra 'Scenario' column and on the end of
+    #the forecast rows' Lookup Col. bands is an optional dict of
+    #{column name: array the same shape as fut_wl} of extra forecast columns,
+    #e.g. simulated percentiles, left blank for past rows.
+    bands = bands or {}
+    if scenario_names is None:
+        fut_wl, slots = fut_wl[None], slots[None]
+        scenario_adds = situations['Waitlist Additions'].values[None]
+        bands = {col: values[None] for col, values in bands.items()}
+    n_scenarios = len(fut_wl)
+    n_weeks = len(fut_weeks)
+    n_past = past_rows[:, 1] - past_rows[:, 0]
+    n_rows = n_past + 2 * n_weeks * n_scenarios
+    #Which situation each row belongs to, and how far into its block it is
+    sit = np.repeat(np.arange(len(situations)), n_rows)
+    row = np.arange(n_rows.sum()) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    past = row < n_past[sit]
+    past_pos = (past_rows[:, 0][sit] + row)[past]
+    fut = row[~past] - n_past[sit][~past]
+    fut_sit, scenario = sit[~past], fut // (2 * n_weeks)
+    fut_week, undef = (fut % (2 * n_weeks)) // 2, fut % 2
+
+    output = {}
+    week = np.empty(len(sit), dtype=object)
+    week[past] = past_weeks[past_pos]
+    week[~past] = np.asarray(fut_weeks, dtype=object)[fut_week]
+    output['Week End'] = week
+    for col in GROUPING_COLS:
+        output[col] = situations[col].values[sit]
+    inc_undef = np.full(len(sit), np.nan, dtype=object)
+    inc_undef[~past] = np.array(['Y', 'N'], dtype=object)[undef]
+    output['Including Undefined'] = inc_undef
+    #Lookup for the excel vlookups, week + grouping + including undefined
+    #(+ scenario)
+    main_lookup = situations[GROUPING_COLS].astype(object).sum(axis=1).values
+    suffix = np.full(len(sit), '', dtype=object)
+    suffix[~past] = inc_undef[~past]
+    if scenario_names is not None:
+        scenario_col = np.full(len(sit), np.nan, dtype=object)
+        scenario_col[~past] = np.asarray(scenario_names, dtype=object)[scenario]
+        suffix[~past] = suffix[~past] + scenario_col[~past]
+    output['Lookup Col'] = week + main_lookup.astype(object)[sit] + suffix
+    for i, col in enumerate(['Waitlist Size', 'Waitlist Additions', 'Attendances']):
+        values = np.empty(len(sit))
+        values[past] = past_values[past_pos, i]
+        output[col] = values
+    output['Waitlist Size'][~past] = np.rint(fut_wl[scenario, undef, fut_sit,
+                                                    fut_week])
+    output['Waitlist Additions'][~past] = np.rint(scenario_adds[scenario,
+                                                                fut_sit])
+    output['Attendances'][~past] = slots[scenario, undef, fut_sit, fut_week]
+    output['Past/Future'] = np.where(past, 'Past', 'Forecast').astype(object)
+    if scenario_names is not None:
+        output['Scenario'] = scenario_col
+    for col, values in bands.items():
+        output[col] = np.full(len(sit), np.nan)
+        output[col][~past] = np.rint(values[scenario, undef, fut_sit, fut_week])
+    return pd.DataFrame(output)
+
+def forecast_dataset(start, cancer_wl, store, cancer_slots, fut_weeks,
+                     scenarios=None, n_sims=0, seed=0, indexes=None):
+    #Function to calculate each situation's past data and forecast and build
+    #the full dataset. The past data (sliced from the week store) and future
+    #slots are indexed by grouping once (or given as indexes, from
+    #forecast_indexes), so each situation is a lookup rather than a filter of
+    #the full datasets. Situations are forecast grouped by
+    #clinic code (see order_situations). If a scenarios table is given,
+    #every situation is forecast under every scenario at once. If n_sims is
+    #more than 0, each situation's wait list is also simulated n_sims times
+    #with resampled additions, adding a column for each percentile in
+    #SIMULATION_PERCENTILES.
+    past_index, past_weeks, past_values, slots_index = (
+        indexes if indexes is not None
+        else forecast_indexes(start, cancer_wl, store, cancer_slots, fut_weeks))
+    situations = order_situations(start)
+    keys = list(zip(*[situations[col] for col in GROUPING_COLS]))
+    #Where each situation's past data is in the past data arrays
+    past_rows = np.array([past_index.get(key, (0, 0)) for key in keys],
+                         dtype=int).reshape(-1, 2)
+    #Slots for each future week, including and excluding undefined
+    slots = np.array([situation_slots(slots_index, spec, cc, N_FU, len(fut_weeks))
+                      for spec, cc, prior, N_FU in keys]
+                     ).reshape(-1, 2, len(fut_weeks)).transpose(1, 0, 2)
+    if n_sims:
+        #Each situation's random seed comes from its data (the slots before
+        #any scenario scales them), so it is simulated the same however the
+        #situations are split up, deduplicated or scenarios added
+        adds_history = situation_weekly(situations, store, 'Waitlist Additions')
+        seeds = simulation_seeds(situations['Waitlist Size'].values,
+                                 adds_history, slots, seed)
+    if scenarios is None:
+        #Future wait list position for every situation, including and
+        #excluding undefined, in one go.
+        adds, adds_multiplier, adds_offset = (situations['Waitlist Additions']
+                                              .values, 1, 0)
+        scenario_names = None
+    else:
+        #Future wait list position for every scenario and situation, including
+        #and excluding undefined, in one go.
+        adds, slots = scenario_inputs(scenarios,
+                                      situations['Waitlist Additions'].values,
+                                      slots)
+        adds_multiplier = scenario_setting(scenarios, 'Additions Multiplier'
+                                           ).reshape(-1, 1)
+        adds_offset = scenario_setting(scenarios, 'Additions Offset'
+                                       ).reshape(-1, 1)
+        scenario_names = scenarios['Scenario'].tolist()
+    fut_WL = forecast_waitlist(situations['Waitlist Size'].values,
+                               adds if scenarios is None else adds[:, None, :],
+                               slots)
+    bands = None
+    if n_sims:
+        simulated = simulate_waitlist(situations['Waitlist Size'].values,
+                                      adds_history, slots, seeds, n_sims,
+                                      adds_multiplier, adds_offset)
+        bands = {f'Waitlist P{percentile}': values for percentile, values
+                 in zip(SIMULATION_PERCENTILES, simulated)}
+    return build_output(situations, past_rows, past_weeks, past_values,
+                        fut_weeks, fut_WL, slots, scenario_names,
+                        None if scenarios is None else adds, bands)
@@ -0,0 +1,345 @@
+import pandas as pd
+import numpy as np
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+from cancer_wl_engine import GROUPING_COLS
+
+################################################################################
+                             #####Write to Excel#####
+################################################################################
+#Most rows of data an excel sheet can hold (1,048,576 less the header row)
+EXCEL_MAX_ROWS = 1048575
+
+def shard_rows(wl_full_dataset, max_rows=EXCEL_MAX_ROWS):
+    #Function to split Full Data into sheets of at most max_rows rows. Sheets are
+    #only split between groupings, so each grouping's rows are all on one sheet
+    #for the dashboard to look up. Returns the (first row, last row + 1) of
+    #wl_full_dataset on each sheet.
+    main_lookup = wl_full_dataset[GROUPING_COLS].astype(object).sum(axis=1).values
+    block_starts = np.append(np.flatnonzero(main_lookup[1:] != main_lookup[:-1]) + 1,
+                             len(main_lookup))
+    shards = []
+    first = 0
+    while first < len(main_lookup):
+        #Last grouping to start that still fits on this sheet
+        last = block_starts[block_starts <= first + max_rows].max()
+        if last == first:
+            raise ValueError(f'A grouping has more than {max_rows} rows, so '
+                             'will not fit on one sheet')
+        shards.append((first, last))
+        first = last
+    return shards or [(0, 0)]
+
+def lookup_index(wl_full_dataset, shards, aliases=None):
+    #Function to get the rows of Full Data each grouping's data is in, so the
+    #dashboard only has to search those rows rather than the whole sheet. Each
+    #grouping's rows are together in Full Data. Returns a row per grouping with
+    #its lookup key, the key its rows are stored under, the first and last
+    #excel row of its data and the number of the Full Data sheet it is on. If
+    #duplicate groupings were removed, aliases maps every grouping's key to the
+    #key its rows are stored under.
+    main_lookup = wl_full_dataset[GROUPING_COLS].astype(object).sum(axis=1).values
+    block_starts = np.append(0, np.flatnonzero(main_lookup[1:] != main_lookup[:-1]) + 1)
+    block_ends = np.append(block_starts[1:], len(main_lookup)) - 1
+    shard_starts = np.array([first for first, _ in shards])
+    sheet = np.searchsorted(shard_starts, block_starts, side='right')
+    #+2 as excel rows start at 1, and there is a header row
+    offset = shard_starts[sheet - 1] - 2
+    index = pd.DataFrame({'Key':main_lookup[block_starts],
+                          'Block Key':main_lookup[block_starts],
+                          'First Row':block_starts - offset,
+                          'Last Row':block_ends - offset,
+                          'Sheet':sheet})
+    #If a key is in more than one place, the first is the one looked up
+    index = index.drop_duplicates(subset='Key')
+    if aliases is not None:
+        index = (aliases[['Key', 'Block Key']]
+                 .merge(index.drop(columns='Key'), on='Block Key', how='left'))
+    return index
+
+def full_data_sheets(n_sheets):
+    #Function to get the names of the Full Data sheets
+    return ['Full Data'] + [f'Full Data {i}' for i in range(2, n_sheets + 1)]
+
+def full_data_lookup(key, col, sheets):
+    #Function to get the formula to look up a value from a column of Full Data,
+    #only searching the rows for the selected grouping (found in the hidden row
+    #9 of the dashboard) instead of the whole column. If Full Data is split over
+    #more than one sheet, the sheet the grouping is on is chosen.
+    lookups = [f"INDEX('{sheet}'!${col}:${col},$C$9-1+MATCH({key},"
+               f"INDEX('{sheet}'!$G:$G,$C$9):INDEX('{sheet}'!$G:$G,$D$9),0))"
+               for sheet in sheets]
+    if len(lookups) == 1:
+        return '=' + lookups[0]
+    return f"=CHOOSE($F$9,{','.join(lookups)})"
+
+#Rows of a dataframe turned into python values at once while writing it
+WRITE_CHUNK_ROWS = 50000
+
+def write_rows(ws, df, header_format, chunk_rows=WRITE_CHUNK_ROWS):
+    #Function to write a dataframe to a sheet a row at a time (header first),
+    #as constant memory mode needs. Missing values are left blank. The rows
+    #are turned into python values chunk_rows at a time, so a full sheet is
+    #never held as python objects at once.
+    ws.write_row(0, 0, list(df.columns), header_format)
+    for first in range(0, len(df), chunk_rows):
+        chunk = df.iloc[first:first + chunk_rows]
+        for row, values in enumerate(zip(*[chunk[col].tolist()
+                                           for col in chunk.columns]),
+                                     first + 1):
+            ws.write_row(row, 0, [None if value != value else value
+                                  for value in values])
+
+def write_workbook(wl_full_dataset, file_path, constant_memory=True,
+                   max_rows=EXCEL_MAX_ROWS, aliases=None):
+    #Function to write the full dataset and the dashboard that looks it up to
+    #an excel workbook. In constant memory mode each row is written to disk
+    #once it is finished rather than the whole workbook being kept in memory,
+    #so every sheet is written in row order. Full Data is split over as many
+    #sheets as it needs to stay under excel's row limit. If duplicate
+    #groupings were removed, aliases is the table of every grouping and the
+    #grouping its data is stored under, which the dropdowns and lookup index
+    #are made from.
+    groupings = wl_full_dataset if aliases is None else aliases
+
+    #wl_full_dataset['Specialty'] = wl_full_dataset['Specialty'].str.replace(' ', '_').str.replace('&', '').str.replace('-', '')
+    specialty_lookup = (groupings[['Specialty', 'Clinic Code']].drop_duplicates()
+                        .groupby('Specialty')['Clinic Code'].apply(list).to_dict())
+
+    #Weeks for the dashboard table, the values are filled in by excel formulae
+    weeks = (wl_full_dataset['Week End'].drop_duplicates().sort_values()
+                                        .tolist())
+
+    ######Initial Set Up
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory':constant_memory})
+    shards = shard_rows(wl_full_dataset, max_rows)
+    sheets = full_data_sheets(len(shards))
+
+    dash_ws = workbook.add_worksheet('Dash')
+    fulldata_wss = [workbook.add_worksheet(sheet) for sheet in sheets]
+    lookup_ws = workbook.add_worksheet('Look Up')
+    index_ws = workbook.add_worksheet('Look Up Index')
+
+    ######Formats
+    #Same header style as pandas uses for to_excel
+    table_header_format = workbook.add_format({'bold':True, 'border':1,
+                                               'align':'center', 'valign':'top'})
+    #White background
+    bg_format = workbook.add_format({'font_size':12, 'align':'centre',
+                                     'valign':'centre', 'bg_color':'white',
+                                     'text_wrap':True})
+    #Filter box formats
+    #hidden_format = workbook.add_format({'hidden': True})
+    header_format1 = workbook.add_format({'font_size':18, 'bold':True, 'align':'centre', 'valign':'centre',  'border':True, 'text_wrap':True})
+    header_format2 = workbook.add_format({'font_size':14, 'bold':True, 'align':'centre', 'valign':'centre',  'border':True, 'text_wrap':True})
+    filter_format1 = workbook.add_format({'font_size':14, 'bold':True, 'align':'centre', 'valign':'centre', 'border':True,})
+    filter_format2 = workbook.add_format({'font_size':14, 'bold':True, 'align':'centre', 'valign':'centre', 'border':True, 'bg_color':'yellow'})
+
+    ######Full Data Set
+    for ws, (first, last) in zip(fulldata_wss, shards):
+        write_rows(ws, wl_full_dataset.iloc[first:last], table_header_format)
+
+    ######Lookup index sheet
+    index = lookup_index(wl_full_dataset, shards, aliases)
+    write_rows(index_ws, index, table_header_format)
+    index_ws.hide()
+    no_index = len(index) + 1
+
+    ######Lookup sheet
+    #Specialties in column A, what-if scenarios (if any) in column B, then each
+    #specialty's clinic codes as a column from C onwards. Written a row at a
+    #time.
+    specialties = groupings['Specialty'].drop_duplicates().tolist()
+    scenarios = (wl_full_dataset['Scenario'].dropna().drop_duplicates().tolist()
+                 if 'Scenario' in wl_full_dataset else [])
+    lookup_ws.write(0, 0, 'Specialty', table_header_format)
+    if scenarios:
+        lookup_ws.write(0, 1, 'Scenario', table_header_format)
+    for row in range(max([len(specialties) + 1, len(scenarios) + 1]
+                         + [len(clinic_codes) for
+                            clinic_codes in specialty_lookup.values()])):
+        if 0 < row <= len(specialties):
+            lookup_ws.write(row, 0, specialties[row - 1])
+        if 0 < row <= len(scenarios):
+            lookup_ws.write(row, 1, scenarios[row - 1])
+        lookup_ws.write_row(row, 2, [clinic_codes[row] if row < len(clinic_codes)
+                                     else None for clinic_codes
+                                     in specialty_lookup.values()])
+    #test.to_excel(writer, sheet_name='Look Up', index=False, startcol=3)
+    #n_rows = test.shape[0]
+    #wl_full_dataset['Clinic Code'].drop_duplicates().to_excel(writer, sheet_name='Look Up', index=False, startcol=2)
+
+    #To create named groups within each specialty code, you need to write each one as a column
+    col = 2
+    for specialty, clinic_codes in specialty_lookup.items():
+        #Create a named range for each specialties column.  Remove unaccepted charecters
+        range_name = specialty.replace(' ', '_').replace('&', '').replace('-', '')
+
+        #Code to get the correct excel column, can I do better?
+        #if col <= 25:
+        #    column = chr(65+col)
+        #elif col <= 51:
+        #    column = 'A'+chr(65+col-26)
+        #elif col <= 77:
+        #    column = 'B'+chr(65+col-26-26)
+        #else:
+        #    column = 'C'+chr(65+col-26-26-26)
+        column = ''
+        col1 = col + 1
+        while col1 > 0:
+            col1 -= 1  # Adjust because Excel uses 1-26, not 0-25
+            column = chr(65 + (col1 % 26)) + column
+            col1 //= 26
+
+        range_formula = f"='Look Up'!${column}$1:${column}${len(clinic_codes)}"
+        workbook.define_name(range_name, range_formula)
+        col += 1
+
+    ######Dashboard
+    #White background and default column widths
+    dash_ws.set_column('A:AE', 15, bg_format)
+    dash_ws.set_column('A:A', 4, bg_format)
+    dash_ws.set_column('F:F', 4, bg_format)
+    #dash_ws.set_column('F:F', None, None, {'hidden': True})
+    dash_ws.set_row(2, None,  bg_format)
+    for row in range(0, 9):
+        dash_ws.set_row(row + 2, 21)
+    dash_ws.set_row(7, None, None, {'hidden': True})#hide lookup value row
+    dash_ws.set_row(8, None, None, {'hidden': True})#hide index row
+
+        ##########Filter section
+    #definition column and selection column, a row at a time
+    dash_ws.merge_range('B2:E2', 'Filters', header_format1)
+    dash_ws.merge_range('B3:C3', 'Specialty', filter_format1)
+    dash_ws.merge_range('D3:E3', 'All', filter_format2)
+    dash_ws.merge_range('B4:C4', 'Clinic Code', filter_format1)
+    dash_ws.merge_range('D4:E4', 'All', filter_format2)
+    dash_ws.merge_range('B5:C5', 'Priority', filter_format1)
+    dash_ws.merge_range('D5:E5', 'All', filter_format2)
+    dash_ws.merge_range('B6:C6', 'New/Follow Up', filter_format1)
+    dash_ws.merge_range('D6:E6', 'All', filter_format2)
+    dash_ws.merge_range('B7:C7', 'Including Undefined', filter_format1)
+    dash_ws.merge_range('D7:E7', 'Y', filter_format2)
+    dash_ws.merge_range('B8:E8', '=D3&D4&D5&D6', filter_format1)
+    #Find the selection in the index, and get the rows of Full Data it is in
+    dash_ws.write('B9', f"=MATCH(B8,'Look Up Index'!$A$2:$A${no_index},0)")
+    dash_ws.write('C9', f"=INDEX('Look Up Index'!$C$2:$C${no_index},B9)")
+    dash_ws.write('D9', f"=INDEX('Look Up Index'!$D$2:$D${no_index},B9)")
+    dash_ws.write('E9', f"=INDEX('Look Up Index'!$B$2:$B${no_index},B9)")
+    dash_ws.write('F9', f"=INDEX('Look Up Index'!$E$2:$E${no_index},B9)")
+    #What-if scenario selection, below the hidden rows so it sits with the
+    #other filters
+    if scenarios:
+        dash_ws.merge_range('B10:C10', 'Scenario', filter_format1)
+        dash_ws.merge_range('D10:E10', scenarios[0], filter_format2)
+        dash_ws.data_validation('D10', {'validate':'list',
+                                        'source':f"'Look Up'!$B$2:$B${len(scenarios) + 1}"})
+
+    no_spec = groupings['Specialty'].nunique() + 1
+    no_cc = groupings['Clinic Code'].nunique() + 1
+
+    dash_ws.data_validation('D3', {'validate':'list', 'source':f"'Look Up'!A2:A{no_spec}"})
+
+    #dash_ws.data_validation('D4', {'validate':'list', 'source':f"'Look Up'!C2:C{no_cc}"})
+    #dash_ws.data_validation('D4', {'validate' : 'list', 'source': f"=INDEX('Look Up'!$D$1:$E${n_rows}, 0, MATCH(D3, 'Look Up'!$D$1:$E${n_rows}, 0))"})
+
+    #To get dynamic CC drop down, lookup the name of the selected specialty code (with unaccepted charecters removed).
+    dash_ws.data_validation('D4', {'validate':'list', 'source':f'=INDIRECT(SUBSTITUTE(SUBSTITUTE(SUBSTITUTE(D3," ","_"),"-",""),"&",""))'})
+
+    dash_ws.data_validation('D5', {'validate':'list', 'source':groupings['Priority'].drop_duplicates().tolist()})
+    dash_ws.data_validation('D6', {'validate':'list', 'source':groupings['New/Follow Up'].drop_duplicates().tolist()})
+    dash_ws.data_validation('D7', {'validate':'list', 'source':wl_full_dataset['Including Undefined'].dropna().drop_duplicates().tolist()})
+
+        #########Table section
+    #headers
+    dash_ws.write_row('B11', ['Week End', 'Waitlist Size', 'Waitlist Additions',
+                              'Attendances'], header_format2)
+    #Simulated wait list percentiles (if any) for the forecast weeks, in the
+    #columns under the graphs
+    bands = [col for col in wl_full_dataset.columns
+             if col.startswith('Waitlist P')]
+    band_cols = [xl_col_to_name(7 + i) for i in range(len(bands))]
+    if bands:
+        dash_ws.write_row('H11', bands)
+    #Populate the table with the weeks and lookups of the selected grouping's
+    #rows. Add 0s and 1s under where the graphs will sit to fill in future
+    #section.
+    for row in range(12, max(21, 12 + len(weeks))):
+        if row - 12 < len(weeks):
+            dash_ws.write(f'B{row}', weeks[row - 12])
+        if row < 18:
+            #Past data
+            key = f'$B{row}&$E$9'
+        elif row < 21:
+            #Forecast data
+            key = f'$B{row}&$E$9&$D$7' + ('&$D$10' if scenarios else '')
+        else:
+            continue
+        dash_ws.write(f'C{row}', full_data_lookup(key, 'H', sheets))
+        dash_ws.write(f'D{row}', full_data_lookup(key, 'I', sheets))
+        dash_ws.write(f'E{row}', full_data_lookup(key, 'J', sheets))
+        dash_ws.write(f'G{row}', 0 if row < 18 else 1)
+        if row >= 18:
+            for band, col in zip(bands, band_cols):
+                dash_ws.write(f'{col}{row}', full_data_lookup(
+                                key, xl_col_to_name(wl_full_dataset.columns
+                                                    .get_loc(band)), sheets))
+
+        ########Graphs
+        ##Line Graph section
+    WL_chart = workbook.add_chart({'type':'line'})
+    WL_chart.add_series({'name':'Wait List Size',
+                         'categories':'=Dash!$B$12:$B$20',
+                         'values':'=Dash!$C$12:$C$20',
+                         'data_labels': {'value': True,
+                                         'position': 'above'},
+                         'smooth':True,
+                         'marker': {'type': 'automatic'},})
+    for band, col in zip(bands, band_cols):
+        if band != 'Waitlist P50':
+            WL_chart.add_series({'name':band.replace('Waitlist ', ''),
+                                 'categories':'=Dash!$B$12:$B$20',
+                                 'values':f'=Dash!${col}$12:${col}$20',
+                                 'line':{'dash_type':'dash', 'color':'#7f7f7f'},
+                                 'marker':{'type':'none'}})
+    fut1 = workbook.add_chart({'type':'area', 'subtype':'percent_stacked'})
+    fut1.add_series({'name':'Future',
+                    'categories':'=Dash!$B$12:$B$20',
+                    'values':'=Dash!$G$12:$G$20',
+                    'y2_axis':True,
+                    'fill':{'color':'#e8dfeb'}})
+    fut1.set_y_axis({'visible':False})
+    WL_chart.combine(fut1)
+    WL_chart.set_x_axis({'name':'Week Ending', 'major_gridlines' :{'visible': False}})
+    WL_chart.set_y_axis({'name':'Waitlist Size', 'major_gridlines' :{'visible': False}})
+    WL_chart.set_chartarea({'border': {'none': True}})
+    dash_ws.insert_chart('G2', WL_chart, {'x_scale': 2.85, 'y_scale': 1.15})
+
+        #Bar Chart section
+    att_add_chart = workbook.add_chart({'type':'column'})
+    att_add_chart.add_series({'name':'Additions',
+                              'categories':'=Dash!$B$12:$B$20',
+                              'values':'=Dash!$D$12:$D$20',
+                              'data_labels': {'value': True},
+                              'fill':{'color':"#76DB6F"}})
+    att_add_chart.add_series({'name':'Attendances',
+                              'categories':'=Dash!$B$12:$B$20',
+                              'values':'=Dash!$E$12:$E$20',
+                              'data_labels': {'value': True},
+                              'fill':{'color':'#0d9603'}})
+    fut2 = workbook.add_chart({'type':'area', 'subtype':'percent_stacked'})
+    fut2.add_series({'name':'Future',
+                    'categories':'=Dash!$B$12:$B$20',
+                    'values':'=Dash!$G$12:$G$20',
+                    'y2_axis':True,
+                    'fill':{'color':'#e8dfeb'}})
+    fut2.set_y_axis({'visible':False})
+    att_add_chart.combine(fut2)
+    att_add_chart.set_title({'name':'Additions and Attendances'})
+    att_add_chart.set_x_axis({'name':'Week Ending', 'major_gridlines' :{'visible': False}})
+    att_add_chart.set_y_axis({'name':'Number of Patients', 'major_gridlines' :{'visible': False}})
+    att_add_chart.set_chartarea({'border': {'none': True}})
+    dash_ws.insert_chart('G16', att_add_chart, {'x_scale': 2.8, 'y_scale': 1.15})
+
+    ######Full Data Set
+    workbook.close()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import create_engine, text, bindparam
+from cancer_wl_engine import share_categories
+
+################################################################################
+                            #####SQL Extraction#####
+################################################################################
+def create_pooled_engine(url, n_connections):
+    #Function to create an engine with a connection for each query that runs at
+    #the same time. No overflow, so we never open more than we asked for, and
+    #connections are checked before use as the server drops idle ones.
+    return create_engine(url, pool_size=n_connections, max_overflow=0,
+                         pool_pre_ping=True)
+
+def shrink_frame(df, key_cols):
+    #Function to cut the memory a frame uses. Integer measures are downcast to
+    #the smallest type that fits and the key columns become categories. Dates
+    #are made 'YYYY-MM-DD' strings first, the same as the model's string dates.
+    for col in df.columns:
+        if col in key_cols:
+            if col == 'Week End':
+                df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d')
+            df[col] = df[col].astype('category')
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def read_chunked(sql, engine, chunksize, key_cols, params=None):
+    #Function to read a query a chunk at a time, shrinking each chunk as it
+    #arrives so the full object dtype result is never held in memory at once.
+    chunks = [shrink_frame(chunk, key_cols)
+              for chunk in pd.read_sql(sql, engine, params=params,
+                                       chunksize=chunksize)]
+    if not chunks:
+        return pd.DataFrame()
+    #Chunks need the same categories to stay categorical when joined
+    share_categories(chunks, key_cols)
+    return pd.concat(chunks, ignore_index=True)
+
+def extract_sources(queries, engine, max_workers=None, params=None,
+                    chunksize=None, key_cols=()):
+    #Function to run each query at the same time on a thread pool, so the total
+    #wait is the slowest query rather than the sum of them all. queries is a
+    #dict of {name: sql}, returns a dict of {name: dataframe} and a dict of
+    #{name: {wall seconds, cpu seconds, rows}} for each query. params is an
+    #optional dict of {name: {param: value}} for queries with :param
+    #placeholders, with list values expanded for IN :param. If chunksize is
+    #given, results are streamed in chunks and shrunk with key_cols made
+    #categorical. If any query fails, the queries not yet started are
+    #cancelled and the error is raised with the name of the query that failed.
+    params = params or {}
+    def read(name, sql):
+        t = time.time()
+        cpu = time.thread_time()
+        if name in params:
+            sql = text(sql).bindparams(*[bindparam(param, expanding=True)
+                                         for param, value in params[name].items()
+                                         if isinstance(value, (list, tuple))])
+        if chunksize:
+            df = read_chunked(sql, engine, chunksize, key_cols, params.get(name))
+        else:
+            df = pd.read_sql(sql, engine, params=params.get(name))
+        return name, df, {'wall_seconds': time.time() - t,
+                          'cpu_seconds': time.thread_time() - cpu,
+                          'rows': len(df)}
+
+    sources = {}
+    timings = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(queries) or 1)
+    try:
+        futures = [executor.submit(read, name, sql)
+                   for name, sql in queries.items()]
+        for future in as_completed(futures):
+            try:
+                name, df, timing = future.result()
+            except Exception as err:
+                failed = [name for name, fut in zip(queries, futures)
+                          if fut is future][0]
+                raise RuntimeError(f'{failed} query failed: {err}') from err
+            sources[name] = df
+            timings[name] = timing
+            print(f'{name} read in {timing["wall_seconds"]:.1f}s ({len(df)} rows)')
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    #Return in the order the queries were given, not the order they finished
+    return ({name: sources[name] for name in queries},
+            {name: timings[name] for name in queries})
+
+
+################################################################################
+                            #####Extract Cache#####
+################################################################################
+#Date to pull from when there is nothing cached
+FULL_HISTORY = '1900-01-01'
+#Days before a source with no rundate is pulled in full again, as there is no
+#rundate to tell if its earlier weeks have changed
+FULL_REFRESH_DAYS = 28
+
+def read_cache(cache_dir, name):
+    #Function to read a cached source and the rundate/week watermark it was
+    #pulled at, returns (None, None) if it hasn't been cached yet.
+    data_path = os.path.join(cache_dir, f'{name}.parquet')
+    meta_path = os.path.join(cache_dir, f'{name}.json')
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None, None
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    return pd.read_parquet(data_path), meta
+
+def write_cache(cache_dir, name, df, meta):
+    #Function to save a source and its watermark for the next run
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_parquet(os.path.join(cache_dir, f'{name}.parquet'), index=False)
+    with open(os.path.join(cache_dir, f'{name}.json'), 'w') as f:
+        json.dump(meta, f)
+
+def week_ends(df):
+    #Function to get a source's week ends as dates, whether they came back as
+    #dates, strings or (in low memory mode) categories of strings.
+    return pd.to_datetime(df['Week End'].astype(str))
+
+def extract_with_cache(queries, engine, cache_dir, cached_sources,
+                       refresh=False, max_workers=None, chunksize=None,
+                       key_cols=(), params=None,
+                       max_age_days=FULL_REFRESH_DAYS):
+    #Function to extract the sources, only pulling the weeks we don't already
+    #have for those in cached_sources. cached_sources is a dict of
+    #{name: rundate sql}, where the rundate sql returns the latest rundate for
+    #that source (or is None if the source has no rundate). Their queries must
+    #filter on [Week End] >= :since. Each cached source is pulled from its most
+    #recent cached week onwards (that week is pulled again in case it was
+    #incomplete) and merged into the cache. The cache is thrown away and the
+    #full history pulled again if the rundate has changed since it was cached,
+    #if the source has no rundate and was last pulled in full more than
+    #max_age_days ago, or if refresh is True. chunksize and key_cols are passed
+    #to extract_sources, as is params for any uncached queries with :param
+    #placeholders. key_cols are only made categorical when chunksize is given.
+    rundates, _ = extract_sources({name: sql for name, sql
+                                   in cached_sources.items() if sql},
+                                  engine, max_workers)
+    rundates = {name: str(df.iloc[0, 0]) for name, df in rundates.items()}
+
+    cache = {}
+    pulled = {}
+    today = pd.Timestamp.now().normalize()
+    params = dict(params or {})
+    for name in cached_sources:
+        df, meta = (None, None) if refresh else read_cache(cache_dir, name)
+        #With no rundate, the cache is only trusted for max_age_days
+        if (df is not None and not cached_sources[name]
+                and today - pd.Timestamp(meta.get('pulled', FULL_HISTORY))
+                    > pd.Timedelta(days=max_age_days)):
+            df = None
+        if df is None or meta['rundate'] != rundates.get(name):
+            print(f'{name} cache refreshed, pulling full history')
+            params[name] = {'since': FULL_HISTORY}
+            pulled[name] = today.strftime('%Y-%m-%d')
+        else:
+            pulled[name] = meta.get('pulled', FULL_HISTORY)
+            print(f'{name} cache up to {meta["watermark"]}, pulling new weeks')
+            params[name] = {'since': meta['watermark']}
+            cache[name] = df.loc[week_ends(df) < pd.Timestamp(meta['watermark'])]
+
+    sources, timings = extract_sources(queries, engine, max_workers, params,
+                                       chunksize, key_cols)
+
+    for name in cached_sources:
+        if name in cache:
+            frames = [cache[name], sources[name]]
+            if chunksize:
+                share_categories(frames, key_cols)
+            sources[name] = pd.concat(frames, ignore_index=True)
+        watermark = (week_ends(sources[name]).max()
+                     if len(sources[name]) else pd.Timestamp(FULL_HISTORY))
+        write_cache(cache_dir, name, sources[name],
+                    {'rundate': rundates.get(name),
+                     'watermark': watermark.strftime('%Y-%m-%d'),
+                     'pulled': pulled[name]})
+    return sources, timings
@@ -0,0 +1,299 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from cancer_wl_engine import GROUPING_COLS, dataset_blocks
+
+################################################################################
+                            #####Dashboard Data#####
+################################################################################
+#Measures shown for each week, the same as the workbook's dashboard table
+MEASURES = ['Waitlist Size', 'Waitlist Additions', 'Attendances']
+
+def nested_index(groupings, blocks):
+    #Function to index each grouping's block by its Specialty, then Clinic
+    #Code, Priority and New/Follow Up, so the (long) values aren't repeated
+    #for every grouping. The page looks a selection up one filter at a time.
+    index = {}
+    for (spec, cc, prior, N_FU), block in zip(groupings, blocks):
+        index.setdefault(spec, {}).setdefault(cc, {}).setdefault(prior, {})[N_FU] = block
+    return index
+
+def to_lists(values):
+    #Function to turn an array into nested lists for JSON, with whole numbers
+    #as ints and missing values as null to keep the payload small.
+    if values.ndim > 1:
+        return [to_lists(part) for part in values]
+    return [None if value != value else int(value) if value == int(value)
+            else round(float(value), 2) for value in values.tolist()]
+
+def dashboard_payload(wl_full_dataset, aliases=None):
+    #Function to build the dashboard's data from the full dataset, indexed so
+    #the page only has to look up the selected grouping. Every grouping's past
+    #data and forecast are arrays lined up with the weeks, so nothing is
+    #searched or filtered when a filter changes. Each week shows the first row
+    #for that week, as the workbook's MATCH does. If duplicate groupings were
+    #removed, aliases points every grouping at the block its data is in.
+    blocks = dataset_blocks(wl_full_dataset)
+    block_of = {key: i for i, key in enumerate(blocks)}
+    if aliases is None:
+        groupings = wl_full_dataset[GROUPING_COLS].drop_duplicates()
+        block_keys = groupings.astype(str).sum(axis=1)
+    else:
+        groupings = aliases
+        block_keys = aliases['Block Key']
+    index = nested_index(groupings[GROUPING_COLS].values.tolist(),
+                         [block_of[key] for key in block_keys])
+    first, last = np.array(list(blocks.values())).reshape(-1, 2).T
+    block = np.repeat(np.arange(len(first)), last - first)
+    past = (wl_full_dataset['Past/Future'] == 'Past').values
+    past_weeks = sorted(wl_full_dataset.loc[past, 'Week End'].astype(str).unique())
+    fut_weeks = sorted(wl_full_dataset.loc[~past, 'Week End'].astype(str).unique())
+
+    #Past data, a (block, week) array per measure. Rows are reversed so the
+    #first row for each week is the one written last.
+    week = pd.Index(past_weeks).get_indexer(wl_full_dataset['Week End'].astype(str))
+    past_data = {}
+    for measure in MEASURES:
+        values = np.full((len(first), len(past_weeks)), np.nan)
+        rows = np.flatnonzero(past)[::-1]
+        values[block[rows], week[rows]] = wl_full_dataset[measure].values[rows]
+        past_data[measure] = to_lists(values)
+
+    #Forecasts, a (block, including undefined, scenario, week) array per
+    #measure and simulated percentile. Forecast additions are the same every
+    #week and with or without undefined, so only a (block, scenario) array is
+    #kept for them.
+    including = ['Y', 'N']
+    scenarios = (wl_full_dataset['Scenario'].dropna().drop_duplicates().tolist()
+                 if 'Scenario' in wl_full_dataset else [None])
+    bands = [col for col in wl_full_dataset.columns if col.startswith('Waitlist P')]
+    rows = np.flatnonzero(~past)
+    fut = wl_full_dataset.iloc[rows]
+    inc = pd.Index(including).get_indexer(fut['Including Undefined'])
+    scenario = (pd.Index(scenarios).get_indexer(fut['Scenario'])
+                if scenarios != [None] else np.zeros(len(fut), dtype=int))
+    fut_week = pd.Index(fut_weeks).get_indexer(fut['Week End'].astype(str))
+    forecast = {}
+    for measure in MEASURES + bands:
+        values = np.full((len(first), len(including), len(scenarios),
+                          len(fut_weeks)), np.nan)
+        values[block[rows], inc, scenario, fut_week] = fut[measure].values
+        forecast[measure] = to_lists(values[:, 0, :, 0]
+                                     if measure == 'Waitlist Additions'
+                                     else values)
+
+    specialty_lookup = (groupings[['Specialty', 'Clinic Code']].drop_duplicates()
+                        .groupby('Specialty', sort=False)['Clinic Code']
+                        .apply(list).to_dict())
+    return {'pastWeeks': past_weeks,
+            'forecastWeeks': fut_weeks,
+            'filters': {'Specialty': list(specialty_lookup),
+                        'Clinic Code': specialty_lookup,
+                        'Priority': groupings['Priority'].drop_duplicates().tolist(),
+                        'New/Follow Up': groupings['New/Follow Up']
+                                         .drop_duplicates().tolist(),
+                        'Including Undefined': including,
+                        'Scenario': scenarios},
+            'bands': bands,
+            'index': index,
+            'past': past_data,
+            'forecast': forecast}
+
+
+################################################################################
+                            #####HTML Dashboard#####
+################################################################################
+#The page filters and draws the charts itself (plain SVG, no libraries), so it
+#opens anywhere without a network connection. The payload is put in place of
+#__PAYLOAD__.
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Cancer WL Forecast</title>
+<style>
+body {font-family: Calibri, Arial, sans-serif; margin: 16px; color: #222;}
+#filters {display: grid; grid-template-columns: max-content 220px; gap: 4px 8px;
+          align-items: center; float: left; margin-right: 24px;}
+#filters label {font-weight: bold;}
+#filters select {font-size: 14px; background: #ffff99;}
+#charts {overflow: hidden;}
+svg {display: block; margin-bottom: 12px;}
+table {border-collapse: collapse; margin-top: 12px; clear: both;}
+th, td {border: 1px solid #999; padding: 2px 8px; text-align: right;}
+th {background: #eee;}
+tr.future td {background: #e8dfeb;}
+#message {color: #a00; font-weight: bold;}
+</style>
+</head>
+<body>
+<h2>Cancer Wait List Forecast</h2>
+<div id="filters"></div>
+<div id="charts">
+<svg id="wl_chart" width="900" height="300"></svg>
+<svg id="att_add_chart" width="900" height="260"></svg>
+</div>
+<div id="message"></div>
+<table id="table"></table>
+<script id="payload" type="application/json">__PAYLOAD__</script>
+<script>
+const data = JSON.parse(document.getElementById('payload').textContent);
+const filters = ['Specialty', 'Clinic Code', 'Priority', 'New/Follow Up',
+                 'Including Undefined'].concat(
+                 data.filters['Scenario'][0] === null ? [] : ['Scenario']);
+const selects = {};
+const box = document.getElementById('filters');
+for (const name of filters) {
+  const label = document.createElement('label');
+  label.textContent = name;
+  const select = document.createElement('select');
+  select.addEventListener('change', () => {
+    if (name === 'Specialty') fillOptions('Clinic Code');
+    draw();
+  });
+  box.append(label, select);
+  selects[name] = select;
+  fillOptions(name);
+}
+for (const name of ['Specialty', 'Clinic Code', 'Priority', 'New/Follow Up']) {
+  if ([...selects[name].options].some(o => o.value === 'All')) selects[name].value = 'All';
+}
+fillOptions('Clinic Code');
+draw();
+
+function fillOptions(name) {
+  //Clinic codes depend on the selected specialty
+  const options = name === 'Clinic Code'
+    ? data.filters['Clinic Code'][selects['Specialty'].value] || []
+    : data.filters[name];
+  const select = selects[name];
+  const current = select.value;
+  select.innerHTML = '';
+  for (const option of options) select.add(new Option(option, option));
+  if (options.includes(current)) select.value = current;
+  else if (options.includes('All')) select.value = 'All';
+}
+
+function draw() {
+  const block = ['Specialty', 'Clinic Code', 'Priority', 'New/Follow Up']
+                .reduce((index, name) => index && index[selects[name].value], data.index);
+  const message = document.getElementById('message');
+  if (block === undefined) {
+    message.textContent = 'No data for this selection';
+    for (const id of ['wl_chart', 'att_add_chart', 'table'])
+      document.getElementById(id).innerHTML = '';
+    return;
+  }
+  message.textContent = '';
+  const inc = data.filters['Including Undefined'].indexOf(selects['Including Undefined'].value);
+  const scenario = selects['Scenario']
+    ? data.filters['Scenario'].indexOf(selects['Scenario'].value) : 0;
+  const weeks = data.pastWeeks.concat(data.forecastWeeks);
+  const series = {};
+  for (const measure of ['Waitlist Size', 'Attendances'])
+    series[measure] = data.past[measure][block]
+                      .concat(data.forecast[measure][block][inc][scenario]);
+  series['Waitlist Additions'] = data.past['Waitlist Additions'][block]
+    .concat(data.forecastWeeks.map(() => data.forecast['Waitlist Additions'][block][scenario]));
+  for (const band of data.bands)
+    series[band] = data.pastWeeks.map(() => null)
+                   .concat(data.forecast[band][block][inc][scenario]);
+  const nPast = data.pastWeeks.length;
+  lineChart(document.getElementById('wl_chart'), weeks, nPast,
+            [['Wait List Size', series['Waitlist Size'], '#4472c4', false]].concat(
+             data.bands.filter(band => band !== 'Waitlist P50')
+                       .map(band => [band.replace('Waitlist ', ''), series[band], '#7f7f7f', true])));
+  barChart(document.getElementById('att_add_chart'), weeks, nPast,
+           [['Additions', series['Waitlist Additions'], '#76DB6F'],
+            ['Attendances', series['Attendances'], '#0d9603']]);
+  table(weeks, nPast, series);
+}
+
+function svgElement(svg, tag, attrs, text) {
+  const element = document.createElementNS('http://www.w3.org/2000/svg', tag);
+  for (const [name, value] of Object.entries(attrs)) element.setAttribute(name, value);
+  if (text !== undefined) element.textContent = text;
+  svg.appendChild(element);
+  return element;
+}
+
+function axes(svg, weeks, nPast, maxValue, title) {
+  //Shaded forecast weeks, week labels and the chart title
+  svg.innerHTML = '';
+  const width = svg.width.baseVal.value, height = svg.height.baseVal.value;
+  const plot = {left: 50, right: width - 20, top: 30, bottom: height - 40};
+  const step = (plot.right - plot.left) / weeks.length;
+  const x = i => plot.left + step * (i + 0.5);
+  const y = v => plot.bottom - (plot.bottom - plot.top) * v / (maxValue || 1);
+  svgElement(svg, 'rect', {x: plot.left + step * nPast, y: plot.top,
+                           width: step * (weeks.length - nPast),
+                           height: plot.bottom - plot.top, fill: '#e8dfeb'});
+  svgElement(svg, 'line', {x1: plot.left, x2: plot.right, y1: plot.bottom,
+                           y2: plot.bottom, stroke: '#999'});
+  weeks.forEach((week, i) => svgElement(svg, 'text', {x: x(i), y: plot.bottom + 16,
+                                        'text-anchor': 'middle', 'font-size': 11}, week));
+  svgElement(svg, 'text', {x: width / 2, y: 18, 'text-anchor': 'middle',
+                           'font-weight': 'bold'}, title);
+  return {x, y, step};
+}
+
+function lineChart(svg, weeks, nPast, lines) {
+  const maxValue = Math.max(0, ...lines.flatMap(line => line[1].filter(v => v !== null)));
+  const {x, y} = axes(svg, weeks, nPast, maxValue * 1.1, 'Wait List Size');
+  for (const [name, values, colour, dashed] of lines) {
+    const points = values.map((v, i) => v === null ? null : [x(i), y(v)]);
+    const path = points.map((p, i) => p === null ? '' :
+                            (i && points[i - 1] ? 'L' : 'M') + p.join(' ')).join(' ');
+    svgElement(svg, 'path', {d: path, fill: 'none', stroke: colour, 'stroke-width': 2,
+                             'stroke-dasharray': dashed ? '6 4' : 'none'});
+    if (dashed) continue;
+    points.forEach((p, i) => {
+      if (p === null) return;
+      svgElement(svg, 'circle', {cx: p[0], cy: p[1], r: 3, fill: colour});
+      svgElement(svg, 'text', {x: p[0], y: p[1] - 8, 'text-anchor': 'middle',
+                               'font-size': 11}, values[i]);
+    });
+  }
+}
+
+function barChart(svg, weeks, nPast, bars) {
+  const maxValue = Math.max(0, ...bars.flatMap(bar => bar[1].filter(v => v !== null)));
+  const {x, y, step} = axes(svg, weeks, nPast, maxValue * 1.15, 'Additions and Attendances');
+  const width = step * 0.8 / bars.length;
+  bars.forEach(([name, values, colour], j) => values.forEach((v, i) => {
+    if (v === null) return;
+    const left = x(i) - step * 0.4 + width * j;
+    svgElement(svg, 'rect', {x: left, y: y(v), width: width, height: y(0) - y(v),
+                             fill: colour});
+    svgElement(svg, 'text', {x: left + width / 2, y: y(v) - 4, 'text-anchor': 'middle',
+                             'font-size': 10}, v);
+  }));
+}
+
+function table(weeks, nPast, series) {
+  const columns = ['Waitlist Size', 'Waitlist Additions', 'Attendances'].concat(data.bands);
+  const rows = ['<tr><th>Week End</th>' + columns.map(c => `<th>${c}</th>`).join('') + '</tr>'];
+  weeks.forEach((week, i) => rows.push(
+    `<tr class="${i < nPast ? 'past' : 'future'}"><td>${week}</td>` +
+    columns.map(c => `<td>${series[c][i] === null ? '' : series[c][i]}</td>`).join('') + '</tr>'));
+  document.getElementById('table').innerHTML = rows.join('');
+}
+</script>
+</body>
+</html>
+"""
+
+def write_dashboard(wl_full_dataset, file_path, aliases=None):
+    #Function to write the dashboard as a single HTML page with its data
+    #inside it, and the data on its own as JSON next to it (same name, ending
+    #' data.json') for anything else that wants it. Returns the paths of both.
+    payload = json.dumps(dashboard_payload(wl_full_dataset, aliases),
+                         separators=(',', ':'))
+    data_path = os.path.splitext(file_path)[0] + ' data.json'
+    with open(data_path, 'w') as f:
+        f.write(payload)
+    #'</' would end the script tag the payload is in
+    with open(file_path, 'w') as f:
+        f.write(DASHBOARD_HTML.replace('__PAYLOAD__', payload.replace('</', '<\\/')))
+    return file_path, data_path
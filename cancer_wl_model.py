@@ -1,19 +1,32 @@
-import pandas as pd
-import numpy as np
-from sqlalchemy import create_engine
+import os
 import time
-import win32com.client as win32
-import xlsxwriter
+import pickle
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
 from datetime import datetime
-import os
-os.chdir('G:/PerfInfo/Performance Management/OR Team/Emily Projects/General Analysis/Cancer Wait List Analysis')
-t0=time.time()
+from cancer_wl_report import start_report, stage, profile_call, write_report
+from cancer_wl_engine import (JOIN_COLS, GROUPING_COLS, str_strip,
+                              combine_sources, weekly_grouping_sets,
+                              build_week_store,
+                              save_week_store, open_week_store,
+                              scenario_start_points, ESTIMATORS,
+                              ESTIMATOR_WINDOW, estimate_additions,
+                              dedupe_situations, forecast_dataset,
+                              forecast_indexes, situation_fingerprints,
+                              changed_situations, merge_forecasts,
+                              DEFAULT_SITES, split_sites)
+
+#Folder the model runs in, with the Cache, Checkpoints and Outputs folders
+WORK_DIR = 'G:/PerfInfo/Performance Management/OR Team/Emily Projects/General Analysis/Cancer Wait List Analysis'
+
 ################################################################################
-                    #####Data Read and Pre-Process#####
+                            #####SQL Queries#####
 ################################################################################
-sdmart_engine = create_engine('mssql+pyodbc://@SDMartDataLive2/InfoDB?'\
-                           'trusted_connection=yes&driver=ODBC+Driver+17'\
-                               '+for+SQL+Server')
+SDMART_URL = ('mssql+pyodbc://@SDMartDataLive2/InfoDB?'\
+              'trusted_connection=yes&driver=ODBC+Driver+17'\
+              '+for+SQL+Server')
 
 ####Waitlist Additions
 add_sql = """WITH ADDNS AS (
@@ -32,17 +45,14 @@ add_sql = """WITH ADDNS AS (
 		    ,[New/Follow-Up] AS [New/Follow Up]
 		    ,[W/List Additions] AS [Waitlist Additions]
 		    FROM [infodb].[PowerBI].[RL_PBI0043_WL_Adds]
-		    WHERE WkEnd_Added < GETDATE())
+		    WHERE WkEnd_Added < GETDATE()
+                  AND WkEnd_Added >= :since)
 
             SELECT [Week End], [Specialty Code], [Clinic Code], [Priority], [New/Follow Up],
                 SUM([Waitlist Additions]) AS [Waitlist Additions]
             FROM ADDNS
             GROUP BY [Week End], [Specialty Code], [Clinic Code], [Priority], [New/Follow Up]"""
 
-add = pd.read_sql(add_sql, sdmart_engine)
-print('Waitlist Additions:')
-print(add.groupby('Week End')['Waitlist Additions'].sum())
-print('------------------------------------------')
 
 ####Waitlist Attendances
 att_sql = """WITH ATT AS (
@@ -63,18 +73,13 @@ att_sql = """WITH ATT AS (
             ,[rundate]
 			FROM [infodb].[PowerBI].[RL_PBI0043_Activity]
 			WHERE rundate = (select MAX(rundate) from [infodb].[PowerBI].[RL_PBI0043_Activity])
-                  AND [Session Week] < GETDATE())
+                  AND [Session Week] < GETDATE()
+                  AND [Session Week] >= :since)
 
             SELECT [rundate], [Week End], [Specialty Code], [Clinic Code], [Priority], [New/Follow Up],
                    SUM([Attendances]) AS [Attendances]
             FROM ATT
             GROUP BY [rundate], [Week End], [Specialty Code], [Clinic Code], [Priority], [New/Follow Up]"""
-att = pd.read_sql(att_sql, sdmart_engine)
-
-print(f'Attendances run date: {att['rundate'].drop_duplicates().iloc[0]}')
-print('Total Attendances:')
-print(att.groupby('Week End')['Attendances'].sum())
-print('------------------------------------------')
 
 ####Historical Waitlist Size
 wl_sql = """WITH WL AS (
@@ -94,49 +99,28 @@ wl_sql = """WITH WL AS (
 			,[Waitlist Size]
             ,[rundate]
 			FROM [infodb].[PowerBI].[RL_PBI0043_WL_Past]
-			WHERE  [Session Week] <  GETDATE())
+			WHERE  [Session Week] <  GETDATE()
+                   AND [Session Week] >= :since)
 
             SELECT [rundate], [Week End], [Specialty Code], [Clinic Code], [Priority], [New/Follow Up],
                 SUM([Waitlist Size]) AS [Waitlist Size]
             FROM WL
             GROUP BY [rundate], [Week End], [Specialty Code], [Clinic Code], [Priority], [New/Follow Up]"""
 
-wl = pd.read_sql(wl_sql, sdmart_engine)
-wl['Week End'] = wl['Week End'].astype('datetime64[ns]')
-wl['Specialty Code'] = wl['Specialty Code'].str.strip()
-
-print(f'Waitlist run date: {wl['rundate'].drop_duplicates().iloc[0]}')
-print('Waitlist Totals:')
-print(wl.groupby('Week End')['Waitlist Size'].sum())
-print('------------------------------------------')
 
 ####Specialty Lookup
 pfmgt_spec_sql = """SELECT spcd AS [Specialty Code],
                            pfmgt_spec,
                            pfmgt_spec_desc AS [Specialty]
                            FROM infodb.dbo.vw_cset_specialties"""
-pfmgt_spec = pd.read_sql(pfmgt_spec_sql, sdmart_engine)
-
-####Join together
-#Correct date formats between past and future in output, not the same format
-cancer_wl = (wl
-                .merge(add
-                    .merge(att, on=['Week End', 'Specialty Code', 'Clinic Code',
-                                   'Priority', 'New/Follow Up'], how='outer'),
-                on=['Week End', 'Specialty Code', 'Clinic Code', 'Priority',
-                    'New/Follow Up'], how='outer'))
-
-#Merge onto specialty descriptions, ensure no unwanted specialties are included
-cancer_wl = cancer_wl.merge(pfmgt_spec, on='Specialty Code', how='left')
-cancer_wl = cancer_wl.loc[~cancer_wl['Specialty Code'].isin(['ZZ','ZN','99'])]
-#Make date column string
-cancer_wl['Week End'] = cancer_wl['Week End'].astype(str)
+
 
 ####Futre slots
 cancer_slots_sql = """--SLOTS
 SELECT
 DATEADD(DAY, 7 - (@@DATEFIRST-1) - DATEPART(WEEKDAY, infodb.dbo.fn_remove_time(util.[session_start_dttm])), 
 		infodb.dbo.fn_remove_time(util.[session_start_dttm])) AS [Week End]
+,util.[provider] AS [Site]
 ,spec.[pfmgt_spec_desc] AS [Specialty Name]
 ,spec.[pfmgt_spec] AS [Specialty]
 ,util.[clinic_code] AS [Clinic Code]
@@ -170,423 +154,466 @@ AND CONVERT(DATE, util.[session_start_dttm])
 --Other filterings
 AND util.[session_cancr_dttm] IS NULL -- Restrict to held sessions only
 AND util.[template_flag] ='N' --not templates
-AND util.[provider] ='RK900'
+AND util.[provider] IN :sites
 AND util.[sstat_desc] IN ('Session Scheduled')  -- on hold too?
 AND spec.[pfmgt_spec] NOT IN ('ZZ','ZN','99')
 
 GROUP BY DATEADD(DAY, 7 - (@@DATEFIRST-1) - DATEPART(WEEKDAY, infodb.dbo.fn_remove_time(util.[session_start_dttm])), 
 		 infodb.dbo.fn_remove_time(util.[session_start_dttm])),
-		 [pfmgt_spec_desc], spec.[pfmgt_spec], util.[clinic_code], util.[new_fup_status]
+		 util.[provider], [pfmgt_spec_desc], spec.[pfmgt_spec], util.[clinic_code], util.[new_fup_status]
 ORDER BY [Week End]
 """
-cancer_slots = pd.read_sql_query(cancer_slots_sql, sdmart_engine)
 
-print('Future Slots:')
-print(cancer_slots.groupby('Week End')['Slots'].sum())
-print('------------------------------------------')
-
-#Initial fixing of formatting
-cancer_slots['Week End'] = cancer_slots['Week End'].astype(str)
-cancer_wl['Priority'] = cancer_wl['Priority'].str.strip()
-cancer_wl['Past/Future'] = 'Past'
-
-#Group up priorities
+####Sessions each site has had in each clinic code, to split the history
+####between the sites in batch mode
+site_clinics_sql = """SELECT util.[provider] AS [Site]
+,util.[clinic_code] AS [Clinic Code]
+,COUNT(*) AS [Sessions]
+FROM infodb.dbo.[vw_sess_util] AS util
+WHERE util.[provider] IN :sites
+AND util.[template_flag] ='N' --not templates
+GROUP BY util.[provider], util.[clinic_code]"""
 
-#List of forecast weeks
-fut_weeks = (cancer_slots['Week End'].drop_duplicates().sort_values()
-                                     .astype(str).values.tolist())
+####Latest run dates, used to tell if the cached history is still valid
+rundate_sql = {'add': None,
+               'att': 'SELECT MAX(rundate) FROM [infodb].[PowerBI].[RL_PBI0043_Activity]',
+               'wl': 'SELECT MAX(rundate) FROM [infodb].[PowerBI].[RL_PBI0043_WL_Past]'}
 
 
 ################################################################################
-                   #####Get start point of each scenario#####
+                            #####Model Stages#####
 ################################################################################
-#List of all the end wait list size and l6w additions to start the forecasts on
-#for every possible filtering in the data.
-
-def aggregation(cols):
-    #Function to sum the wl and additions for each grouping for each week then
-    #get the most recent wl size and average L6W additions ready for forecasting
-    agg_df = (cancer_wl.groupby(cols + ['Week End'], as_index=False)
-                                [['Waitlist Size', 'Waitlist Additions']].sum()
-                       .groupby(cols, as_index=False)
-                                .agg({'Waitlist Size':'last',
-                                      'Waitlist Additions':'mean'}))
-    return agg_df
-
-start = pd.concat([
-        #All data
-        (pd.DataFrame(cancer_wl.groupby('Week End')
-                      [['Waitlist Size', 'Waitlist Additions']].sum()
-                      .agg({'Waitlist Size': lambda x: x.iloc[-1],
-                            'Waitlist Additions': 'mean'})).T),
-        #One column filtering
-        aggregation(['Specialty']),
-        aggregation(['Clinic Code']),
-        aggregation(['Priority']),
-        aggregation(['New/Follow Up']),
-        #Two column filtering
-        aggregation(['Specialty',   'Clinic Code']),
-        aggregation(['Specialty',   'Priority']),
-        aggregation(['Specialty',   'New/Follow Up']),
-        aggregation(['Clinic Code', 'Priority']),
-        aggregation(['Clinic Code', 'New/Follow Up']),
-        aggregation(['Priority',    'New/Follow Up']),
-        #Three column filtering
-        aggregation(['Specialty',   'Clinic Code', 'Priority']),
-        aggregation(['Specialty',   'Clinic Code', 'New/Follow Up']),
-        aggregation(['Specialty',   'Priority',    'New/Follow Up']),
-        aggregation(['Clinic Code', 'Priority',    'New/Follow Up']),
-        #Four column filtering
-        aggregation(['Specialty', 'Clinic Code', 'Priority', 'New/Follow Up'])
-        ])
-
-#Fill Nans with 0 if wl size or additions, or All if a cateorgy
-start[['Waitlist Size',
-       'Waitlist Additions']] = start[['Waitlist Size',
-                                       'Waitlist Additions']].fillna(0)
-start[['Specialty', 'Clinic Code',
-       'Priority','New/Follow Up']] = start[['Specialty', 'Clinic Code',
-                                             'Priority', 'New/Follow Up']
-                                             ].fillna('All')
+#Each stage takes the run's options and report and the outputs of earlier
+#stages it needs, and returns a dict of its own outputs. The outputs are saved
+#as a checkpoint, so a rerun can start from any stage without redoing the ones
+#before it. win32com, xlsxwriter and the SQL drivers are only imported by the
+#stages that use them, so the compute stages run anywhere.
+def extract(options, report):
+    #Run all the queries at the same time, each on its own pooled connection.
+    #The historical sources are cached, so only weeks since the last run are
+    #pulled.
+    from cancer_wl_extract import create_pooled_engine, extract_with_cache
+    queries = {'add': add_sql,
+               'att': att_sql,
+               'wl': wl_sql,
+               'pfmgt_spec': pfmgt_spec_sql,
+               'cancer_slots': cancer_slots_sql}
+    #Slots for the sites being run, and in batch mode each clinic code's site
+    params = {'cancer_slots': {'sites': options.sites or DEFAULT_SITES}}
+    if options.sites:
+        queries['site_clinics'] = site_clinics_sql
+        params['site_clinics'] = {'sites': options.sites}
+    sdmart_engine = create_pooled_engine(SDMART_URL, len(queries))
+    with stage(report, 'extract') as record:
+        #Each query's wall time, CPU time and rows are kept in the report
+        sources, record['queries'] = extract_with_cache(
+                                        queries, sdmart_engine, 'Cache',
+                                        rundate_sql,
+                                        refresh=options.refresh_cache,
+                                        chunksize=(100000 if options.low_memory
+                                                   else None),
+                                        key_cols=(JOIN_COLS if options.low_memory
+                                                  else ()),
+                                        params=params)
+        record['rows'] = sum(len(df) for df in sources.values())
+    return {'sources': sources}
+
+def combine(options, report, sources):
+    add, att, wl, pfmgt_spec, cancer_slots = [sources[name] for name in
+                                              ['add', 'att', 'wl', 'pfmgt_spec',
+                                               'cancer_slots']]
+    print('------------------------------------------')
+
+    print('Waitlist Additions:')
+    print(add.groupby('Week End')['Waitlist Additions'].sum())
+    print('------------------------------------------')
+
+    print(f'Attendances run date: {att['rundate'].drop_duplicates().iloc[0]}')
+    print('Total Attendances:')
+    print(att.groupby('Week End')['Attendances'].sum())
+    print('------------------------------------------')
+
+    #Low memory dates are already categories of 'YYYY-MM-DD' strings
+    if not options.low_memory:
+        wl['Week End'] = wl['Week End'].astype('datetime64[ns]')
+    wl['Specialty Code'] = str_strip(wl['Specialty Code'])
+
+    print(f'Waitlist run date: {wl['rundate'].drop_duplicates().iloc[0]}')
+    print('Waitlist Totals:')
+    print(wl.groupby('Week End')['Waitlist Size'].sum())
+    print('------------------------------------------')
+
+    ####Join together
+    #Correct date formats between past and future in output, not the same format
+    with stage(report, 'combine') as record:
+        cancer_wl = combine_sources(add, att, wl, pfmgt_spec)
+        record['rows'] = len(cancer_wl)
+
+    print('Future Slots:')
+    print(cancer_slots.groupby('Week End')['Slots'].sum())
+    print('------------------------------------------')
+
+    #Initial fixing of formatting
+    cancer_slots['Week End'] = cancer_slots['Week End'].astype(str)
+
+    #List of forecast weeks
+    fut_weeks = (cancer_slots['Week End'].drop_duplicates().sort_values()
+                                         .astype(str).values.tolist())
+    return {'cancer_wl': cancer_wl, 'cancer_slots': cancer_slots,
+            'fut_weeks': fut_weeks,
+            'site_clinics': sources.get('site_clinics')}
+
+def rollup(options, report, cancer_wl):
+    #List of all the end wait list size and l6w additions to start the
+    #forecasts on for every possible filtering in the data.
+    #All 16 groupings are rolled up in one pass from the finest weekly
+    #aggregate, rather than re-grouping the full dataset once per grouping.
+    #The weekly totals go into the week store, a dense (grouping, week,
+    #measure) array saved with the checkpoint that the start points and each
+    #grouping's past data are sliced from.
+    measures = ['Waitlist Size', 'Waitlist Additions', 'Attendances']
+    with stage(report, 'rollup') as record:
+        weekly = weekly_grouping_sets(cancer_wl, measures)
+        store = build_week_store(weekly, measures)
+        store_dir = save_week_store(store, os.path.join(options.checkpoint_dir,
+                                                        'week_store'))
+        #Fill Nans with 0 if wl size or additions, or All if a cateorgy
+        start = scenario_start_points(store)
+        #Weekly additions to forecast with, from the first estimator. Any
+        #others are worked out from the same slice of the store and saved
+        #next to the workbook to compare.
+        estimates = estimate_additions(store, options.estimator,
+                                       options.estimator_window)
+        start['Waitlist Additions'] = estimates[options.estimator[0]]
+        if len(estimates) > 1:
+            compare = start[GROUPING_COLS].assign(**{f'Additions ({name})': values
+                                                     for name, values
+                                                     in estimates.items()})
+            compare.to_csv(options.file_path.replace('.xlsx', ' additions.csv'),
+                           index=False)
+        record['estimator'] = options.estimator[0]
+        record['weeks'] = len(store['weeks'])
+        record['rows'] = len(start)
+    return {'start': start, 'store_dir': store_dir}
+
+def read_scenarios(path):
+    #Function to read the what-if scenarios to forecast from a CSV, one row per
+    #scenario. A 'Baseline' scenario with no changes is added first if there
+    #isn't one, so the dashboard can always show the forecast as it is.
+    scenarios = pd.read_csv(path)
+    if 'Baseline' not in scenarios['Scenario'].values:
+        scenarios = pd.concat([pd.DataFrame({'Scenario': ['Baseline']}),
+                               scenarios], ignore_index=True)
+    return scenarios
+
+def forecast(options, report, start, cancer_wl, store_dir, cancer_slots,
+             fut_weeks):
+    #Index the past data and future slots by grouping once, then forecast every
+    #situation in one go, keeping each situation's past data before its
+    #forecast.
+    #What-if scenarios to forecast alongside the baseline, if any
+    scenarios = read_scenarios(options.scenarios) if options.scenarios else None
+    #With more than one worker, the clinic codes are forecast in parallel.
+    if options.workers > 1:
+        from cancer_wl_parallel import forecast_dataset_parallel
+        def forecast_func(*args, indexes=None):
+            return forecast_dataset_parallel(*args, workers=options.workers,
+                                             scenarios=scenarios,
+                                             n_sims=options.simulations,
+                                             seed=options.seed,
+                                             executor=options.executor,
+                                             indexes=indexes)
+    else:
+        def forecast_func(*args, indexes=None):
+            return forecast_dataset(*args, scenarios=scenarios,
+                                    n_sims=options.simulations,
+                                    seed=options.seed, indexes=indexes)
+    with stage(report, 'forecast') as record:
+        #The week store is memory mapped, so only the rows sliced are read
+        store = open_week_store(store_dir)
+        #Only forecast one of each set of groupings with the same data, the
+        #rest are looked up from it through the aliases.
+        aliases = None
+        situations = start
+        if options.dedupe:
+            situations, aliases = dedupe_situations(start, cancer_wl,
+                                                    cancer_slots, fut_weeks)
+        #Incremental runs only forecast the situations whose inputs have
+        #changed since the last run, and copy the rest from its output.
+        #The past data and slots indexes are built once for both the
+        #fingerprints and the forecast.
+        fingerprints = None
+        indexes = None
+        changed = np.ones(len(situations), dtype=bool)
+        if options.incremental:
+            settings = (None if scenarios is None
+                        else scenarios.to_csv(index=False),
+                        options.simulations, options.seed)
+            indexes = forecast_indexes(situations, cancer_wl, store,
+                                       cancer_slots, fut_weeks)
+            fingerprints = situation_fingerprints(situations, cancer_wl, store,
+                                                  cancer_slots, fut_weeks,
+                                                  settings, indexes)
+            previous = previous_checkpoint(options.checkpoint_dir, 'forecast')
+            if previous and previous.get('fingerprints'):
+                changed = changed_situations(situations, fingerprints,
+                                             previous['fingerprints'])
+        wl_full_dataset = None
+        if changed.any():
+            if options.profile_forecast:
+                wl_full_dataset = profile_call(options.file_path.replace('.xlsx',
+                                                                         ' forecast.prof'),
+                                               forecast_func,
+                                               situations.loc[changed], cancer_wl,
+                                               store, cancer_slots, fut_weeks,
+                                               indexes=indexes)
+            else:
+                wl_full_dataset = forecast_func(situations.loc[changed],
+                                                cancer_wl, store, cancer_slots,
+                                                fut_weeks, indexes=indexes)
+        if not changed.all():
+            wl_full_dataset = merge_forecasts(situations, wl_full_dataset,
+                                              previous['wl_full_dataset'])
+        record['workers'] = options.workers
+        record['scenarios'] = 1 if scenarios is None else len(scenarios)
+        record['simulations'] = options.simulations
+        record['situations'] = len(start)
+        record['unique_situations'] = len(situations)
+        record['recomputed'] = int(changed.sum())
+        record['rows'] = len(wl_full_dataset)
+    return {'wl_full_dataset': wl_full_dataset, 'aliases': aliases,
+            'fingerprints': fingerprints}
+
+def render(options, report, wl_full_dataset, aliases):
+    from cancer_wl_excel import write_workbook
+    with stage(report, 'render') as record:
+        write_workbook(wl_full_dataset, options.file_path, aliases=aliases)
+        record['rows'] = len(wl_full_dataset)
+        if options.html:
+            from cancer_wl_html import write_dashboard
+            html_path, _ = write_dashboard(wl_full_dataset,
+                                           options.file_path.replace('.xlsx', '.html'),
+                                           aliases=aliases)
+            print(f'Dashboard saved to {html_path}')
+    return {'file_path': options.file_path}
+
+def deliver(options, report, file_path):
+    #send email with latest flagged output attatched
+    import win32com.client as win32
+    with stage(report, 'deliver'):
+        # Create Outlook application object and mail item
+        outlook = win32.Dispatch('outlook.application')
+        mail = outlook.CreateItem(0)
+        # Set email properties
+        mail.To = open(r'G:/PerfInfo/Performance Management/OR Team/Emily Projects/General Analysis/Cancer Wait List Analysis/emails.txt', 'r').read()
+        mail.Subject = 'Cancer WL Forecast'
+        mail.HTMLBody = f"""<p>Hi Callum,</p>
+<p>Please see attatched this week's Cancer WL forecast</p>
+<p>Emily</p>""" + open('G:/PerfInfo/Performance Management/OR Team/Emily Projects/General Analysis/Cancer Wait List Analysis/email signature.txt', 'r').read()
+        #attatch file, from the work dir the workbook was written to (main has
+        #already changed into it)
+        mail.Attachments.Add(os.path.abspath(file_path))
+        # Send email
+        mail.Send()
+    print(f"Email sent successfully")
+    return {}
+
+#Each stage in the order they run, with the earlier outputs they need
+STAGES = {'extract': (extract, []),
+          'combine': (combine, ['sources']),
+          'rollup': (rollup, ['cancer_wl']),
+          'forecast': (forecast, ['start', 'cancer_wl', 'store_dir',
+                                  'cancer_slots', 'fut_weeks']),
+          'render': (render, ['wl_full_dataset', 'aliases']),
+          'deliver': (deliver, ['file_path'])}
 
 
 ################################################################################
-                #####Calculate Each Past Data and Forecast#####
+                            #####Checkpoints#####
 ################################################################################
-#Empty lists to store results
-#past_data = []
-output_table = []
-#Loop through each clinic code (biggest group) & pre-filter to improve run time
-for cc in start['Clinic Code'].drop_duplicates().values.tolist():
-    #If data is not all, filter to that clinic code
-    if cc != 'All':
-        cc_filter_hist = cancer_wl.loc[cancer_wl['Clinic Code'] == cc].copy()
-        cc_filter_slots = cancer_slots.loc[cancer_slots['Clinic Code'] == cc].copy()
+#Checkpoints are pickled so the outputs come back exactly as they were, types
+#and categories included. The week store is saved in its own folder next to
+#them (see save_week_store), so it can be memory mapped rather than unpickled.
+def checkpoint_path(checkpoint_dir, stage_name):
+    return os.path.join(checkpoint_dir, f'{stage_name}.pkl')
+
+def save_checkpoint(checkpoint_dir, stage_name, outputs):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(checkpoint_path(checkpoint_dir, stage_name), 'wb') as f:
+        pickle.dump(outputs, f)
+
+def previous_checkpoint(checkpoint_dir, stage_name):
+    #Function to load the latest checkpoint of a stage from this run or an
+    #earlier one, returns None if there isn't one.
+    checkpoint_root, run_date = os.path.split(checkpoint_dir)
+    if not os.path.isdir(checkpoint_root):
+        return None
+    for earlier in sorted(os.listdir(checkpoint_root), reverse=True):
+        path = checkpoint_path(os.path.join(checkpoint_root, earlier), stage_name)
+        if earlier <= run_date and os.path.exists(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+    return None
+
+def load_inputs(checkpoint_dir, stage_name, outputs):
+    #Function to load the outputs a stage needs that haven't been made in this
+    #run from the checkpoints of the stages before it, latest first.
+    stage_names = list(STAGES)
+    for earlier in reversed(stage_names[:stage_names.index(stage_name)]):
+        missing = [name for name in STAGES[stage_name][1] if name not in outputs]
+        if not missing:
+            break
+        path = checkpoint_path(checkpoint_dir, earlier)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                outputs.update({name: value for name, value in pickle.load(f).items()
+                                if name in missing})
+    missing = [name for name in STAGES[stage_name][1] if name not in outputs]
+    if missing:
+        raise FileNotFoundError(f'No checkpoint of {", ".join(missing)} in '
+                                f'{checkpoint_dir} to start {stage_name} from, '
+                                'run from an earlier stage')
+
+def run_stages(options, outputs=None):
+    #Function to run the stages from options.start to options.stop, saving each
+    #stage's outputs as a checkpoint, and write the run report. outputs are
+    #any earlier outputs already in memory, the rest are loaded from the
+    #checkpoints.
+    report = start_report(options.trace_memory)
+    stage_names = list(STAGES)
+    outputs = dict(outputs or {})
+    for stage_name in stage_names[stage_names.index(options.start):
+                                  stage_names.index(options.stop) + 1]:
+        func, inputs = STAGES[stage_name]
+        load_inputs(options.checkpoint_dir, stage_name, outputs)
+        stage_outputs = func(options, report,
+                             **{name: outputs[name] for name in inputs})
+        save_checkpoint(options.checkpoint_dir, stage_name, stage_outputs)
+        outputs.update(stage_outputs)
+    print(f'Run report saved to {write_report(report, options.file_path)}')
+    return outputs
+
+def run_batch(options):
+    #Function to run the model for every site in options.sites from one pull
+    #of the sources. Extract and combine run once for all the sites (with
+    #their checkpoints in Checkpoints/<run date>), the combined data is split
+    #by site, then the stages from rollup on run for each site with its own
+    #checkpoints (Checkpoints/<site>/<run date>) and workbook. With more than
+    #one worker, every site's forecast runs on one shared pool of workers.
+    stage_names = list(STAGES)
+    split_after = stage_names.index('combine')
+    site_start = stage_names[max(stage_names.index(options.start),
+                                 split_after + 1)]
+    shared_outputs = None
+    if stage_names.index(options.start) <= split_after:
+        shared = argparse.Namespace(**vars(options))
+        shared.stop = stage_names[min(stage_names.index(options.stop),
+                                      split_after)]
+        shared_outputs = run_stages(shared)
+        if stage_names.index(options.stop) <= split_after:
+            return
+        site_sources = split_sites(shared_outputs['cancer_wl'],
+                                   shared_outputs['cancer_slots'],
+                                   shared_outputs['site_clinics'], options.sites)
+    executor = (ProcessPoolExecutor(max_workers=options.workers)
+                if options.workers > 1 else None)
+    try:
+        for site in options.sites:
+            site_options = argparse.Namespace(**vars(options))
+            site_options.start = site_start
+            site_options.checkpoint_dir = os.path.join('Checkpoints', site,
+                                                       options.run_date)
+            site_options.file_path = (f'Outputs/Caner WL Forecast {site} '
+                                      f'{options.run_date}.xlsx')
+            site_options.executor = executor
+            outputs = None
+            if shared_outputs is not None:
+                if site not in site_sources:
+                    print(f'No history for {site}, skipped')
+                    continue
+                cancer_wl, cancer_slots = site_sources[site]
+                #Saved as the site's combine checkpoint, so a site can be
+                #rerun (or backtested) on its own
+                outputs = {'cancer_wl': cancer_wl, 'cancer_slots': cancer_slots,
+                           'fut_weeks': shared_outputs['fut_weeks']}
+                save_checkpoint(site_options.checkpoint_dir, 'combine', outputs)
+            print(f'------------------ {site} ------------------')
+            run_stages(site_options, outputs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cancer wait list forecast')
+    parser.add_argument('--start', default='extract', choices=list(STAGES),
+                        help='stage to start from, using the checkpoints of '
+                        'the stages before it')
+    parser.add_argument('--stop', default='deliver', choices=list(STAGES),
+                        help='last stage to run')
+    parser.add_argument('--work-dir', default=WORK_DIR)
+    parser.add_argument('--run-date', default=datetime.today().strftime('%Y-%m-%d'),
+                        help='date of the run, for the checkpoints and workbook '
+                        'name (to resume an earlier run)')
+    #Ignore the cached history and pull everything from SQL again
+    parser.add_argument('--refresh-cache', action='store_true')
+    #Stream the extracts in chunks, with the key columns as shared categories,
+    #to cut peak memory on large extracts
+    parser.add_argument('--low-memory', action='store_true')
+    #Trace memory to record each stage's peak in the run report. It slows the
+    #python parts of the model down several times, so the report's times
+    #aren't comparable with untraced runs
+    parser.add_argument('--trace-memory', action='store_true')
+    #Run the forecast under cProfile, saving the stats next to the workbook
+    parser.add_argument('--profile-forecast', action='store_true')
+    #Forecast and store every grouping, even ones with the same data as another
+    parser.add_argument('--no-dedupe', dest='dedupe', action='store_false')
+    #Only forecast the groupings whose inputs changed since the last run
+    parser.add_argument('--incremental', action='store_true')
+    #Also write the dashboard as a standalone HTML page (and its JSON data)
+    #next to the workbook
+    parser.add_argument('--html', action='store_true')
+    #How to estimate each grouping's weekly additions, see ESTIMATORS. The
+    #first is forecast with, any others are saved alongside to compare
+    parser.add_argument('--estimator', nargs='+', choices=list(ESTIMATORS),
+                        default=['mean'])
+    parser.add_argument('--estimator-window', type=int,
+                        default=ESTIMATOR_WINDOW,
+                        help='weeks of additions the rolling, ewma and '
+                        'seasonal estimators average over')
+    #Number of processes to forecast the clinic codes on, 1 runs it serially
+    parser.add_argument('--workers', type=int, default=1)
+    #Batch mode, see run_batch
+    parser.add_argument('--sites', nargs='+', help='providers to run the '
+                        'model for from one pull of the sources, with a '
+                        'workbook for each (by default just '
+                        f'{", ".join(DEFAULT_SITES)}, with one workbook)')
+    #Number of times to simulate each grouping's wait list with resampled
+    #additions for the P10/P50/P90 bands, 0 to skip
+    parser.add_argument('--simulations', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed for the simulations')
+    #CSV of what-if scenarios, see read_scenarios
+    parser.add_argument('--scenarios', help='CSV of what-if scenarios to '
+                        'forecast, with a Scenario column and any of Slots '
+                        'Multiplier, Slots Offset, Additions Multiplier and '
+                        'Additions Offset')
+    options = parser.parse_args()
+    if (list(STAGES).index(options.start) > list(STAGES).index(options.stop)):
+        parser.error('--start must not be after --stop')
+
+    os.chdir(options.work_dir)
+    options.checkpoint_dir = os.path.join('Checkpoints', options.run_date)
+    options.file_path = f'Outputs/Caner WL Forecast {options.run_date}.xlsx'
+    options.executor = None
+    t0=time.time()
+    if options.sites:
+        run_batch(options)
     else:
-        cc_filter_hist = cancer_wl.copy()
-        cc_filter_slots = cancer_slots.copy()
-    #Filter the start table to those combinations
-    start_filter = start.loc[start['Clinic Code'] == cc].drop('Clinic Code', axis=1)
-
-    #Evaluate each situation for that clinic code
-    for situation in start_filter.values.tolist():
-        #Update variables
-        WL_start, adds, spec, prior, N_FU = situation
-        main_lookup = spec + cc + prior + N_FU #for excel vlookup
-        #If the row is for a specialty and/or appointment type filtering,
-        #add these to a list of conditions for past and slots datasets.
-        hist_conds = []
-        slots_conds = []
-        if spec != 'All':
-            hist_conds.append(cancer_wl['Specialty'] == spec)
-            slots_conds.append(cancer_slots['Specialty Name'] == spec)
-        if prior != 'All':
-            hist_conds.append(cancer_wl['Priority'] == prior)
-        if N_FU != 'All':
-            hist_conds.append(cancer_wl['New/Follow Up'] == N_FU)
-            slots_conds.append(cancer_slots['New/Follow Up']
-                               .isin(['Undefined', N_FU]))
-        
-        
-        ######################################################Hist Data
-        #Filter the historical dataset based on the conditions abobve
-        filter_hist = cc_filter_hist.copy()
-        for cond in hist_conds:
-            filter_hist = filter_hist.loc[cond].copy()
-        
-        #If data is not at a granular level, we need to aggregate it up to get
-        #the data for this grouping
-        if len(filter_hist) > 6:
-            agg_past = (filter_hist.groupby('Week End', as_index=False)
-                        [['Waitlist Size', 'Waitlist Additions', 'Attendances']]
-                        .sum().values.tolist())
-        else:
-            agg_past = filter_hist[['Week End', 'Waitlist Size',
-                       'Waitlist Additions', 'Attendances']].values.tolist()
-
-        #For each of the past 6 weeks, append the data to the past data list
-        for row in agg_past:
-            week, wl_size, add, att = row
-            output_table.append([week, spec, cc, prior, N_FU, np.nan,
-                                 week+main_lookup, wl_size, add, att, 'Past'])
-
-
-        ######################################################Forecast
-        #Filter the slots dataset based on the conditions above
-        filter_slots = cc_filter_slots.copy()
-        for cond in slots_conds:
-            filter_slots = filter_slots.loc[cond].copy()
-
-        #group up by week to get overall slots for this grouping
-        all_filter_slots = filter_slots.groupby('Week End')['Slots'].sum()
-
-        #make a copy with undefined removed if it exists to produce 2 forecasts.
-        if 'Undefined' in filter_slots['New/Follow Up'].values:
-            no_undef_filter_slots = (filter_slots.loc[
-                                   filter_slots['New/Follow Up'] != 'Undefined']
-                                   .groupby('Week End')['Slots'].sum())
-        #If no undefined, both forecasts will be the same. Copy all data.
-        else:
-            no_undef_filter_slots = all_filter_slots.copy()
-
-        #Calculate future wait list position
-        fut_WL_inc_undef = []
-        fut_WL_exc_undef = []
-        WL_inc_undef = WL_start
-        WL_exc_undef = WL_start
-        #Iterate over each future week
-        for week in fut_weeks:
-            ####including undefined
-            try: #If week isnt in the data, make 0
-                slots_inc_undef = all_filter_slots.loc[week].copy()
-            except:
-                slots_inc_undef = 0
-            #Work out the predicted waitlist size for this timestep
-            new_WL_inc_undef = max(WL_inc_undef + adds - slots_inc_undef, 0)
-            fut_WL_inc_undef.append(new_WL_inc_undef)
-            WL_inc_undef = new_WL_inc_undef
-            #record results
-            output_table.append(
-                        [week, spec, cc, prior, N_FU, 'Y', week+main_lookup+'Y',
-                         round(new_WL_inc_undef), round(adds), slots_inc_undef,
-                         'Forecast'])
-
-            ####excluding undefined
-            try: #If week isnt in the data, make 0
-                slots_exc_undef = no_undef_filter_slots.loc[week]
-            except:
-                slots_exc_undef = 0
-            #Work out the predicted waitlist size for this timestep
-            new_WL_exc_undef = max(WL_exc_undef + adds - slots_exc_undef, 0)
-            fut_WL_exc_undef.append(new_WL_exc_undef)
-            WL_exc_undef = new_WL_exc_undef
-            #record results
-            output_table.append(
-                        [week, spec, cc, prior, N_FU, 'N', week+main_lookup+'N',
-                         round(new_WL_exc_undef), round(adds), slots_exc_undef,
-                         'Forecast'])
-
-#Create dataframe of outputs
-wl_full_dataset = pd.DataFrame(output_table,
-                               columns=['Week End', 'Specialty', 'Clinic Code',
-                                        'Priority', 'New/Follow Up',
-                                        'Including Undefined', 'Lookup Col',
-                                        'Waitlist Size', 'Waitlist Additions',
-                                        'Attendances', 'Past/Future'])
-
-#wl_full_dataset['Specialty'] = wl_full_dataset['Specialty'].str.replace(' ', '_').str.replace('&', '').str.replace('-', '')
-specialty_lookup = (wl_full_dataset[['Specialty', 'Clinic Code']].drop_duplicates()
-                    .groupby('Specialty')['Clinic Code'].apply(list).to_dict())
-
-################################################################################
-                             #####Write to Excel#####
-################################################################################
-#Create a table template with the dates and nans to be filled in by excel formulae
-wl_tabletemplate = wl_full_dataset[['Week End', 'Waitlist Size',
-                                    'Waitlist Additions', 'Attendances']
-                   ].drop_duplicates(subset='Week End').sort_values(by='Week End')
-cols = [i for i in wl_tabletemplate.columns if (i != 'Week End' and i != 'Past/Future')]
-wl_tabletemplate[cols] = np.nan
-
-######Initial Set Up
-file_path = f'Outputs/Caner WL Forecast {datetime.today().strftime('%Y-%m-%d')}.xlsx'
-writer = pd.ExcelWriter(file_path, engine='xlsxwriter')
-workbook = writer.book
-
-dash_ws = workbook.add_worksheet('Dash')
-writer.sheets['Dash'] = dash_ws
-
-fulldata_ws = workbook.add_worksheet('Full Data')
-writer.sheets['Full Data'] = fulldata_ws
-
-lookup_ws = workbook.add_worksheet('Look Up')
-writer.sheets['Look Up'] = lookup_ws
-
-######Full Data Set
-wl_full_dataset.to_excel(writer, sheet_name='Full Data', index=False)
-
-######Lookup sheet
-wl_full_dataset['Specialty'].drop_duplicates().to_excel(writer, sheet_name='Look Up', index=False)
-#test.to_excel(writer, sheet_name='Look Up', index=False, startcol=3)
-#n_rows = test.shape[0]
-#wl_full_dataset['Clinic Code'].drop_duplicates().to_excel(writer, sheet_name='Look Up', index=False, startcol=2)
-
-#To create named groups within each specialty code, you need to write each one as a column
-col = 2
-for specialty, clinic_codes in specialty_lookup.items():
-    #Write in specialty and clinic codes as a column
-    for row, item in enumerate(clinic_codes):
-        lookup_ws.write(row, col, item)
-    #Create a named range for each specialties column.  Remove unaccepted charecters
-    range_name = specialty.replace(' ', '_').replace('&', '').replace('-', '')
-
-    #Code to get the correct excel column, can I do better?
-    #if col <= 25:
-    #    column = chr(65+col)
-    #elif col <= 51:
-    #    column = 'A'+chr(65+col-26)
-    #elif col <= 77:
-    #    column = 'B'+chr(65+col-26-26)
-    #else:
-    #    column = 'C'+chr(65+col-26-26-26)
-    column = ''
-    col1 = col + 1
-    while col1 > 0:
-        col1 -= 1  # Adjust because Excel uses 1-26, not 0-25
-        column = chr(65 + (col1 % 26)) + column
-        col1 //= 26
-
-    range_formula = f"='Look Up'!${column}$1:${column}${len(clinic_codes)}"
-    workbook.define_name(range_name, range_formula)
-    col += 1
-
-######Formats
-#White background
-bg_format = workbook.add_format({'font_size':12, 'align':'centre',
-                                 'valign':'centre', 'bg_color':'white',
-                                 'text_wrap':True})
-#Filter box formats
-#hidden_format = workbook.add_format({'hidden': True})
-header_format1 = workbook.add_format({'font_size':18, 'bold':True, 'align':'centre', 'valign':'centre',  'border':True, 'text_wrap':True})
-header_format2 = workbook.add_format({'font_size':14, 'bold':True, 'align':'centre', 'valign':'centre',  'border':True, 'text_wrap':True})
-filter_format1 = workbook.add_format({'font_size':14, 'bold':True, 'align':'centre', 'valign':'centre', 'border':True,})
-filter_format2 = workbook.add_format({'font_size':14, 'bold':True, 'align':'centre', 'valign':'centre', 'border':True, 'bg_color':'yellow'})
-
-######Dashboard
-wl_tabletemplate.to_excel(writer, sheet_name='Dash', index=False,
-                          startrow=10, startcol=1)
-
-#White background and default column widths
-dash_ws.set_column('A:AE', 15, bg_format)
-dash_ws.set_column('A:A', 4, bg_format)
-dash_ws.set_column('F:F', 4, bg_format)
-#dash_ws.set_column('F:F', None, None, {'hidden': True})
-dash_ws.set_row(2, None,  bg_format)
-for row in range(0, 9):
-    dash_ws.set_row(row + 2, 21)
-
-    ##########Filter section
-#definition column
-dash_ws.merge_range('B2:E2', 'Filters', header_format1)
-dash_ws.merge_range('B3:C3', 'Specialty', filter_format1)
-dash_ws.merge_range('B4:C4', 'Clinic Code', filter_format1)
-dash_ws.merge_range('B5:C5', 'Priority', filter_format1)
-dash_ws.merge_range('B6:C6', 'New/Follow Up', filter_format1)
-dash_ws.merge_range('B7:C7', 'Including Undefined', filter_format1)
-dash_ws.merge_range('B8:E8', '=D3&D4&D5&D6', filter_format1)
-dash_ws.set_row(7, None, None, {'hidden': True})#hide lookup value row
-#selection column
-no_spec = wl_full_dataset['Specialty'].nunique() + 1
-no_cc = wl_full_dataset['Clinic Code'].nunique() + 1
-
-dash_ws.data_validation('D3', {'validate':'list', 'source':f"'Look Up'!A2:A{no_spec}"})
-
-#dash_ws.data_validation('D4', {'validate':'list', 'source':f"'Look Up'!C2:C{no_cc}"})
-#dash_ws.data_validation('D4', {'validate' : 'list', 'source': f"=INDEX('Look Up'!$D$1:$E${n_rows}, 0, MATCH(D3, 'Look Up'!$D$1:$E${n_rows}, 0))"})
-
-#To get dynamic CC drop down, lookup the name of the selected specialty code (with unaccepted charecters removed).
-dash_ws.data_validation('D4', {'validate':'list', 'source':f'=INDIRECT(SUBSTITUTE(SUBSTITUTE(SUBSTITUTE(D3," ","_"),"-",""),"&",""))'})
-
-dash_ws.merge_range('D3:E3', 'All', filter_format2)
-dash_ws.merge_range('D4:E4', 'All', filter_format2)
-dash_ws.data_validation('D5', {'validate':'list', 'source':wl_full_dataset['Priority'].drop_duplicates().tolist()})
-dash_ws.merge_range('D5:E5', 'All', filter_format2)
-dash_ws.data_validation('D6', {'validate':'list', 'source':wl_full_dataset['New/Follow Up'].drop_duplicates().tolist()})
-dash_ws.merge_range('D6:E6', 'All', filter_format2)
-dash_ws.data_validation('D7', {'validate':'list', 'source':wl_full_dataset['Including Undefined'].dropna().drop_duplicates().tolist()})
-dash_ws.merge_range('D7:E7', 'Y', filter_format2)
-
-    #########Table section
-#headers
-for loc, col in zip(['B', 'C', 'D', 'E'], wl_tabletemplate.columns[:-1]):
-    dash_ws.write(f'{loc}11', col, header_format2)
-#Populate the table with vlookups
-for row in range(12, 18):
-    #Past data
-    dash_ws.write(f'C{row}', f"=VLOOKUP(B{row}&B8,'Full Data'!G:J,2,0)")
-    dash_ws.write(f'D{row}', f"=VLOOKUP(B{row}&B8,'Full Data'!G:J,3,0)")
-    dash_ws.write(f'E{row}', f"=VLOOKUP(B{row}&B8,'Full Data'!G:J,4,0)")
-for row in range(18, 21):
-    #Forecast data
-    dash_ws.write(f'C{row}', f"=VLOOKUP(B{row}&B8&D7,'Full Data'!G:J,2,0)")
-    dash_ws.write(f'D{row}', f"=VLOOKUP(B{row}&B8&D7,'Full Data'!G:J,3,0)")
-    dash_ws.write(f'E{row}', f"=VLOOKUP(B{row}&B8&D7,'Full Data'!G:J,4,0)")
-
-    ########Graphs
-    #Add 0s and 1s under where the graphs will sit to fill in future section
-    dash_ws.write_column('G12', [0,0,0,0,0,0,1,1,1])
-    ##Line Graph section
-WL_chart = workbook.add_chart({'type':'line'})
-WL_chart.add_series({'name':'Wait List Size',
-                     'categories':'=Dash!$B$12:$B$20',
-                     'values':'=Dash!$C$12:$C$20',
-                     'data_labels': {'value': True,
-                                     'position': 'above'},
-                     'smooth':True,
-                     'marker': {'type': 'automatic'},})
-fut1 = workbook.add_chart({'type':'area', 'subtype':'percent_stacked'})
-fut1.add_series({'name':'Future',
-                'categories':'=Dash!$B$12:$B$20',
-                'values':'=Dash!$G$12:$G$20',
-                'y2_axis':True,
-                'fill':{'color':'#e8dfeb'}})
-fut1.set_y_axis({'visible':False})
-WL_chart.combine(fut1)
-WL_chart.set_x_axis({'name':'Week Ending', 'major_gridlines' :{'visible': False}})
-WL_chart.set_y_axis({'name':'Waitlist Size', 'major_gridlines' :{'visible': False}})
-WL_chart.set_chartarea({'border': {'none': True}})
-dash_ws.insert_chart('G2', WL_chart, {'x_scale': 2.85, 'y_scale': 1.15})
-
-    #Bar Chart section
-att_add_chart = workbook.add_chart({'type':'column'})
-att_add_chart.add_series({'name':'Additions',
-                          'categories':'=Dash!$B$12:$B$20',
-                          'values':'=Dash!$D$12:$D$20',
-                          'data_labels': {'value': True},
-                          'fill':{'color':"#76DB6F"}})
-att_add_chart.add_series({'name':'Attendances',
-                          'categories':'=Dash!$B$12:$B$20',
-                          'values':'=Dash!$E$12:$E$20',
-                          'data_labels': {'value': True},
-                          'fill':{'color':'#0d9603'}})
-fut2 = workbook.add_chart({'type':'area', 'subtype':'percent_stacked'})
-fut2.add_series({'name':'Future',
-                'categories':'=Dash!$B$12:$B$20',
-                'values':'=Dash!$G$12:$G$20',
-                'y2_axis':True,
-                'fill':{'color':'#e8dfeb'}})
-fut2.set_y_axis({'visible':False})
-att_add_chart.combine(fut2)
-att_add_chart.set_title({'name':'Additions and Attendances'})
-att_add_chart.set_x_axis({'name':'Week Ending', 'major_gridlines' :{'visible': False}})
-att_add_chart.set_y_axis({'name':'Number of Patients', 'major_gridlines' :{'visible': False}})
-att_add_chart.set_chartarea({'border': {'none': True}})
-dash_ws.insert_chart('G16', att_add_chart, {'x_scale': 2.8, 'y_scale': 1.15})
-
-######Full Data Set
-writer.close()
-
-t1=time.time()
-print(f'Done in {(t1-t0)/60}')
+        run_stages(options)
+    t1=time.time()
+    print(f'Done in {(t1-t0)/60}')
 
 
-
-
-################################################################################
-                                #Send Email#
-################################################################################
-#send email with latest flagged output attatched    
-# Create Outlook application object and mail item
-outlook = win32.Dispatch('outlook.application')
-mail = outlook.CreateItem(0)    
-# Set email properties
-mail.To = open(r'G:/PerfInfo/Performance Management/OR Team/Emily Projects/General Analysis/Cancer Wait List Analysis/emails.txt', 'r').read()
-mail.Subject = 'Cancer WL Forecast'
-mail.HTMLBody = f"""<p>Hi Callum,</p>
-<p>Please see attatched this week's Cancer WL forecast</p>
-<p>Emily</p>""" + open('G:/PerfInfo/Performance Management/OR Team/Emily Projects/General Analysis/Cancer Wait List Analysis/email signature.txt', 'r').read()
-#attatch file
-mail.Attachments.Add(f'G:/PerfInfo/Performance Management/OR Team/Emily Projects/General Analysis/Cancer Wait List Analysis/{file_path}')
-# Send email
-mail.Send()
-print(f"Email sent successfully")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
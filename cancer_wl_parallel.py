@@ -0,0 +1,83 @@
+import os
+import tempfile
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+from concurrent.futures import ProcessPoolExecutor
+from cancer_wl_engine import (save_week_store, open_week_store,
+                              forecast_dataset)
+
+################################################################################
+                        #####Parallel Forecasting#####
+################################################################################
+#Groupings filtered on a clinic code only need that clinic code's data, so
+#they can be forecast separately for each clinic code.
+def read_partition(path, clinic_codes):
+    #Function to read the rows for some clinic codes from an uncompressed
+    #Arrow file. The file is memory mapped, so every worker shares the one copy
+    #the OS has cached and only the rows it needs are copied out.
+    table = feather.read_table(path, memory_map=True)
+    table = table.filter(pc.is_in(table['Clinic Code'].cast(pa.string()),
+                                  value_set=pa.array(clinic_codes, pa.string())))
+    return table.to_pandas()
+
+def forecast_partition(wl_path, slots_path, store_dir, start, fut_weeks,
+                       scenarios=None, n_sims=0, seed=0):
+    #Function to forecast the situations in start, which are all filtered on
+    #one of a few clinic codes, from just those clinic codes' data. The week
+    #store is memory mapped, so only these situations' rows are read.
+    clinic_codes = start['Clinic Code'].drop_duplicates().tolist()
+    cancer_wl = read_partition(wl_path, clinic_codes)
+    cancer_slots = read_partition(slots_path, clinic_codes)
+    return forecast_dataset(start, cancer_wl, open_week_store(store_dir),
+                            cancer_slots, fut_weeks, scenarios, n_sims, seed)
+
+def forecast_dataset_parallel(start, cancer_wl, store, cancer_slots, fut_weeks,
+                              workers, scenarios=None, n_sims=0, seed=0,
+                              chunks_per_worker=2, executor=None,
+                              indexes=None):
+    #Function to build the same full dataset as forecast_dataset, with the
+    #clinic codes split between a pool of worker processes. cancer_wl and
+    #cancer_slots are written once to memory mapped Arrow files the workers
+    #read from, rather than being pickled to each task, and the workers open
+    #the week store from the folder it was saved in (or a temporary copy if
+    #it was never saved). The situations not filtered on a clinic code ('All')
+    #need all the data, so are forecast here while the workers run. Each
+    #worker gets a run of clinic codes in the order they come in start, and
+    #the results are joined back in that order, so the output is identical to
+    #the serial run. Clinic codes are split into a few chunks per worker so a
+    #slow chunk doesn't hold up the rest. If an executor is given (e.g. one
+    #shared by every site in a batch) its workers are used, otherwise a pool
+    #is started for this forecast. indexes (from forecast_indexes) are only
+    #used for the situations forecast here, the workers build their own.
+    all_cc = start['Clinic Code'] == 'All'
+    clinic_codes = start.loc[~all_cc, 'Clinic Code'].drop_duplicates().values
+    chunks = [chunk for chunk in
+              np.array_split(clinic_codes, max(workers * chunks_per_worker, 1))
+              if len(chunk)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wl_path = os.path.join(tmp_dir, 'cancer_wl.arrow')
+        slots_path = os.path.join(tmp_dir, 'cancer_slots.arrow')
+        for df, path in [(cancer_wl, wl_path), (cancer_slots, slots_path)]:
+            feather.write_feather(pa.Table.from_pandas(df, preserve_index=False),
+                                  path, compression='uncompressed')
+        store_dir = (os.path.dirname(store['values'].filename)
+                     if isinstance(store['values'], np.memmap)
+                     else save_week_store(store, os.path.join(tmp_dir,
+                                                              'week_store')))
+        with (nullcontext(executor) if executor is not None
+              else ProcessPoolExecutor(max_workers=workers)) as executor:
+            futures = [executor.submit(forecast_partition, wl_path, slots_path,
+                                       store_dir,
+                                       start.loc[start['Clinic Code']
+                                                 .isin(chunk)], fut_weeks,
+                                       scenarios, n_sims, seed)
+                       for chunk in chunks]
+            all_dataset = forecast_dataset(start.loc[all_cc], cancer_wl, store,
+                                           cancer_slots, fut_weeks, scenarios,
+                                           n_sims, seed, indexes=indexes)
+            datasets = [all_dataset] + [future.result() for future in futures]
+    return pd.concat(datasets, ignore_index=True)
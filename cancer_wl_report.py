@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+
+################################################################################
+                            #####Run Report#####
+################################################################################
+def start_report(trace_memory=False):
+    #Function to start a report of the run. If trace_memory is True, memory
+    #allocations are traced so each stage's peak memory can be recorded (this
+    #slows python code down several times, so it is off by default and the
+    #times of traced runs shouldn't be compared with untraced ones).
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return {'started': datetime.now().isoformat(timespec='seconds'),
+            'trace_memory': trace_memory,
+            '_t0': (time.time(), time.process_time()),
+            'stages': {}}
+
+@contextmanager
+def stage(report, name):
+    #Context manager to record the wall time, CPU time and peak memory of a
+    #stage of the model in the report. Yields the stage's record, so the stage
+    #can add its row counts or anything else worth tracking to it.
+    record = {}
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        memory_before, _ = tracemalloc.get_traced_memory()
+    t = time.time()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = round(time.time() - t, 3)
+        record['cpu_seconds'] = round(time.process_time() - cpu, 3)
+        if tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            record['peak_mb'] = round((peak - memory_before) / 1e6, 1)
+        report['stages'][name] = record
+        print(f'{name} done in {record["wall_seconds"]:.1f}s')
+
+def profile_call(profile_path, func, *args, **kwargs):
+    #Function to run func under cProfile, saving the stats to profile_path (to
+    #open with pstats or snakeviz) and printing the 20 slowest calls.
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    profiler.dump_stats(profile_path)
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+    return result
+
+def write_report(report, file_path):
+    #Function to write the report as JSON next to the workbook at file_path,
+    #with the same name, and return where it was written. If the run was
+    #resumed part way through, the stages it didn't rerun are kept from the
+    #existing report.
+    t0, cpu0 = report['_t0']
+    output = {key: value for key, value in report.items() if key != '_t0'}
+    output['wall_seconds'] = round(time.time() - t0, 3)
+    output['cpu_seconds'] = round(time.process_time() - cpu0, 3)
+    report_path = os.path.splitext(file_path)[0] + '.json'
+    if os.path.exists(report_path):
+        with open(report_path, 'r') as f:
+            output['stages'] = {**json.load(f)['stages'], **output['stages']}
+    with open(report_path, 'w') as f:
+        json.dump(output, f, indent=2, default=str)
+    return report_path